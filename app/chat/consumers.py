@@ -1,11 +1,11 @@
 import json
-import redis
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
 from .models import Message, PrivateMessage, Notification
 from users.models import Friendship
 from django.db.models import Q
+from matchmaking.orchestration import record_response
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -15,7 +15,6 @@ logger = logging.getLogger(__name__)
 User = get_user_model()
 
 class ChatConsumer(AsyncWebsocketConsumer):
-	redis_client = redis.StrictRedis(host="redis", port=6380, db=0)
 	async def connect(self):
 		logger.info(f"Chat Consummer: {self.scope['user'].username} has connected")
 		self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
@@ -73,10 +72,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
 			await self.handle_ping_response(text_data_json)
 
 	async def handle_ping_response(self, data):
-		user_id = data["user_id"]
 		tournament_id = data["tournament_id"]
 		logger.info("got in handle ping response")
-		self.redis_client.sadd(f"tournament_responses_{tournament_id}", user_id)
+		# the answer is the connected user's, whatever user_id the message claims
+		await record_response(tournament_id, self.scope["user"].id)
 
 	async def handle_chat_message(self, data):
 		message = data["message"]
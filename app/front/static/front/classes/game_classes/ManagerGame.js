@@ -2,6 +2,7 @@ import { POST_JSON } from "../../api.js";
 import managerState from "../ManagerState.js";
 import managerToast from "../ManagerToast.js";
 import { colorToast, endpoints, history_state } from "../../utils/utils.js";
+import { applyFrame, BINARY_SUBPROTOCOL } from "../../utils/pong_protocol.js";
 
 class ManagerGame {
     #error = false;
@@ -12,6 +13,7 @@ class ManagerGame {
     #game_type = undefined;
     #final_score = undefined;
     #game_socket = undefined;
+    #input_seq = 0;
 
     constructor() {}
 
@@ -112,9 +114,15 @@ class ManagerGame {
     async initGame(url, gameType) {
         try {
             this.#setgameType = gameType;
-            this.#setGameSocket = new WebSocket(url);
+            this.#setGameSocket = new WebSocket(url, [BINARY_SUBPROTOCOL]);
+            this.#getGameSocket.binaryType = "arraybuffer";
             this.#getGameSocket.onmessage = (e) => {
                 if (!this.getIsEnded) {
+                    if (e.data instanceof ArrayBuffer) {
+                        // gameplay frames only carry what changed since the previous one
+                        this.#setState = applyFrame(e.data, this.getState);
+                        return ;
+                    }
                     const data = JSON.parse(e.data);
                     switch (data.type) {
                         case "init":
@@ -154,11 +162,14 @@ class ManagerGame {
 
     action(move, role, action) {
         try {
+            // the server acknowledges the last input it applied in state.ack
+            this.#input_seq++;
             this.#getGameSocket.send(JSON.stringify({
                 role: role,
                 movement: move,
                 type: "gameplay",
-				action: action
+				action: action,
+                seq: this.#input_seq
             })); 
         } catch (err) {
             this.#setError = true;
@@ -173,6 +184,7 @@ class ManagerGame {
         }
         this.#setIsEnded = false;
         this.#setUsers = undefined;
+        this.#input_seq = 0;
     }
 
     async createNewGame(data) {
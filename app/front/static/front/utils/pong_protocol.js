@@ -0,0 +1,76 @@
+/* Binary gameplay frames, see server_side_pong/consumers/protocol.py */
+
+const BINARY_SUBPROTOCOL = "pong.binary.v1";
+
+const KEYFRAME = 1;
+const DELTA = 2;
+
+const BALL_POSITION = 1 << 0;
+const BALL_VELOCITY = 1 << 1;
+const PADDLE1 = 1 << 2;
+const PADDLE2 = 1 << 3;
+const SCORES = 1 << 4;
+const ACKS = 1 << 5;
+const INTERVAL = 1 << 6;
+
+const HEADER_SIZE = 4;
+
+/**
+ * Apply one frame to the previous state.
+ * Returns the updated state, or the previous one for a delta received before any keyframe.
+ * @param {ArrayBuffer} buffer
+ * @param {Object} state
+*/
+function applyFrame(buffer, state) {
+    const view = new DataView(buffer);
+    const kind = view.getUint8(0);
+    const mask = view.getUint8(1);
+    let offset = HEADER_SIZE;
+
+    if (kind !== KEYFRAME && kind !== DELTA)
+        return (state);
+    if (kind === DELTA && state === undefined)
+        return (state);
+    if (state === undefined)
+        state = { ball: {}, players: { player1: {}, player2: {} }, scores: {}, ack: {}, interval: undefined };
+
+    if (mask & BALL_POSITION) {
+        state.ball.x = view.getFloat32(offset, true);
+        state.ball.y = view.getFloat32(offset + 4, true);
+        offset += 8;
+    }
+    if (mask & BALL_VELOCITY) {
+        state.ball.vx = view.getFloat32(offset, true);
+        state.ball.vy = view.getFloat32(offset + 4, true);
+        offset += 8;
+    }
+    if (mask & PADDLE1) {
+        state.players.player1.y = view.getFloat32(offset, true);
+        offset += 4;
+    }
+    if (mask & PADDLE2) {
+        state.players.player2.y = view.getFloat32(offset, true);
+        offset += 4;
+    }
+    if (mask & SCORES) {
+        state.scores.player1 = view.getUint16(offset, true);
+        state.scores.player2 = view.getUint16(offset + 2, true);
+        offset += 4;
+    }
+    if (mask & ACKS) {
+        state.ack.player1 = view.getUint32(offset, true);
+        state.ack.player2 = view.getUint32(offset + 4, true);
+        offset += 8;
+    }
+    /* milliseconds until the next frame: the server sends fewer frames when overloaded */
+    if (mask & INTERVAL) {
+        state.interval = view.getUint16(offset, true);
+        offset += 2;
+    }
+    return (state);
+}
+
+export {
+    applyFrame,
+    BINARY_SUBPROTOCOL
+};
@@ -38,6 +38,14 @@ app.conf.beat_schedule = {
         #'schedule': timedelta(seconds=30),
         'schedule': crontab(),  # runs every minute
     },
+    'reap-pong-keys-every-10-minutes': {
+        'task': 'server_side_pong.tasks.reap_pong_keys',
+        'schedule': crontab(minute='*/10'),
+    },
+    'reconcile-player-statistics-every-night': {
+        'task': 'matchmaking.tasks.reconcile_player_statistics',
+        'schedule': crontab(minute=0, hour=4),
+    },
     'clean-blacklisted-tokens-every-2-months': {
         'task': 'users.tasks.clean_expired_blacklisted_tokens',
         'schedule': crontab(0, 0, 1, '*/2'),  # Runs at midnight on the first day of every 2nd month
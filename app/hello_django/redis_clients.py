@@ -0,0 +1,54 @@
+"""
+Redis clients shared by the whole process.
+
+Async code (consumers, the pong engine) must use get_async_redis() so a slow reply
+only suspends the coroutine waiting for it instead of the whole event loop. Sync code
+(views, Celery tasks, management commands) uses get_redis().
+"""
+import asyncio
+import weakref
+import redis
+import redis.asyncio
+from django.conf import settings
+
+_client = None
+# an asyncio connection pool belongs to the event loop it was created on
+_async_clients = weakref.WeakKeyDictionary()
+_async_scripts = weakref.WeakKeyDictionary()  # event loop -> {Lua source: script}
+
+
+def get_redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=0,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+        )
+    return _client
+
+
+def get_async_redis():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        # when every connection is busy, wait for one instead of failing the call
+        pool = redis.asyncio.BlockingConnectionPool(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=0,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+        )
+        client = redis.asyncio.Redis(connection_pool=pool)
+        _async_clients[loop] = client
+    return client
+
+
+def get_async_script(source):
+    """The Lua script `source`, registered once on the async client of the running event loop."""
+    scripts = _async_scripts.setdefault(asyncio.get_running_loop(), {})
+    script = scripts.get(source)
+    if script is None:
+        script = scripts[source] = get_async_redis().register_script(source)
+    return script
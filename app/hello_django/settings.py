@@ -97,15 +97,35 @@ TEMPLATES = [
 WSGI_APPLICATION = 'hello_django.wsgi.application'
 ASGI_APPLICATION = 'hello_django.asgi.application'
 
+# Redis used directly by the app (game state, tournament responses), see hello_django/redis_clients.py
+REDIS_HOST = os.environ.get("REDIS_HOST", "redis")
+REDIS_PORT = int(os.environ.get("REDIS_PORT", "6380"))
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", "50"))  # per process and event loop
+
 CHANNEL_LAYERS = {
 	"default": {
 		"BACKEND": "channels_redis.core.RedisChannelLayer",
 		"CONFIG": {
-			"hosts": [("redis", 6380)],
+			"hosts": [(REDIS_HOST, REDIS_PORT)],
 		},
 	},
 }
 
+# Server side pong: when True the game loop owns the state in memory and only
+# checkpoints it to Redis every PONG_CHECKPOINT_INTERVAL seconds, on score changes and at the end of the game
+PONG_IN_MEMORY_STATE = os.environ.get("PONG_IN_MEMORY_STATE", "True") == "True"
+PONG_CHECKPOINT_INTERVAL = float(os.environ.get("PONG_CHECKPOINT_INTERVAL", "1.0"))
+# 'python' advances games one by one, 'numpy' advances all of them in vectorized batches (needs numpy)
+PONG_PHYSICS_BACKEND = os.environ.get("PONG_PHYSICS_BACKEND", "python")
+# seconds the Redis state of a game survives without being written (the game loop keeps refreshing it)
+PONG_GAME_TTL = int(os.environ.get("PONG_GAME_TTL", "3600"))
+# frames per second sent to the spectators of a game, the players get one per tick
+PONG_SPECTATOR_RATE = int(os.environ.get("PONG_SPECTATOR_RATE", "20"))
+# share of the tick step the engine may spend per tick before sending frames to the players less often
+PONG_TICK_BUDGET = float(os.environ.get("PONG_TICK_BUDGET", "0.8"))
+# bearer token required by /api/metrics/ (engine metrics in the Prometheus format), closed when empty
+PONG_METRICS_TOKEN = os.environ.get("PONG_METRICS_TOKEN", "")
+
 CELERY_BROKER_URL = 'redis://redis:6380/0'
 CELERY_RESULT_BACKEND = 'redis://redis:6380/0'
 CELERY_ACCEPT_CONTENT = ['json']
@@ -5,9 +5,10 @@ from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.core.validators import MinValueValidator
 from server_side_pong.models import Game
-from django.db.models import Sum
+from django.db.models import Count, Sum
 import random
 import logging
+from collections import Counter
 from django.db import transaction
 from django.db.models import F, FloatField, ExpressionWrapper, Value, Case, When
 from django.db.models.functions import Coalesce, Ln
@@ -87,10 +88,39 @@ class Player(models.Model):
 # compute a value dynamically based on other fields in the class without storing
 # it directly in the database.
 #=> le decorateur property fonctionne comme un attribut mais dynamique (méthode déguisée en attribut)
+#les statistiques sont incrémentées une fois par match terminé (signals.update_player_statistics),
+# reconcile() les recompte depuis les matchs pour corriger un éventuel écart
+class PlayerStatisticsManager(models.Manager):
+	def reconcile(self):
+		"""Recount the statistics of every player from the games and fix the rows that drifted. Returns how many were fixed."""
+		with transaction.atomic():
+			# the increments wait for these locks, none of them can land between the count and the fix
+			rows = list(self.select_for_update().order_by('player_id'))
+			rows += self.bulk_create([self.model(player_id=player_id) for player_id in Player.objects.filter(stats__isnull=True).values_list('id', flat=True)])
+			Game.objects.filter(status='completed', stats_recorded=False).update(stats_recorded=True)
+			counted = Game.objects.filter(stats_recorded=True).order_by()
+
+			played = Counter()
+			for field in ('player1', 'player2'):
+				played.update(dict(counted.filter(**{f'{field}__isnull': False}).values(field).annotate(count=Count('id')).values_list(field, 'count')))
+			won = Counter(dict(counted.filter(winner__isnull=False).values('winner').annotate(count=Count('id')).values_list('winner', 'count')))
+
+			drifted = []
+			for stats in rows:
+				if (stats.matches_played, stats.matches_won) != (played[stats.player_id], won[stats.player_id]):
+					logger.warning(f"Statistics of player {stats.player_id} drifted: {stats.matches_played} played, {stats.matches_won} won, counted {played[stats.player_id]} and {won[stats.player_id]}")
+					stats.matches_played = played[stats.player_id]
+					stats.matches_won = won[stats.player_id]
+					drifted.append(stats)
+			self.bulk_update(drifted, ['matches_played', 'matches_won'])
+		return len(drifted)
+
+
 class PlayerStatistics(models.Model):
 	player = models.OneToOneField('Player', on_delete=models.CASCADE, related_name='stats')
 	matches_played = models.IntegerField(default=0)
 	matches_won = models.IntegerField(default=0)
+	objects = PlayerStatisticsManager()
 
 	def __str__(self):
 		return f"{self.player.user.username} Statistics"
@@ -154,8 +184,7 @@ class Tournament(models.Model):
 		return self.name
 
 	def generate_initial_matches(self):
-		from server_side_pong.consumers.consumers import GameManager
-		participants = list(self.participants.all())
+		participants = list(self.participants.select_related('user'))
 		logger.info(f'Participants: {participants}')
 		random.shuffle(participants)
 
@@ -165,11 +194,17 @@ class Tournament(models.Model):
 			self.save()
 
 		# pairs first round
-		game_dict = {}
-		for i in range(0, len(participants), 2):
-			player1 = participants[i]
-			player2 = participants[i+1]
-			game = Game.objects.create(
+		return self.create_round_games(participants)
+
+	def create_round_games(self, players):
+		"""
+		Games of the current round between players taken two by two: one INSERT for the
+		games, one for their link to the tournament and one Redis round trip for their states.
+		Returns {game_id: (player1_id, player2_id)}.
+		"""
+		from server_side_pong.consumers.consumers import GameManager
+		games = Game.objects.bulk_create([
+			Game(
 				name=f'{self.name}, round {self.current_round} with {player1.nickname} vs {player2.nickname}',
 				created_by=player1,
 				player1=player1,
@@ -178,11 +213,13 @@ class Tournament(models.Model):
 				status='scheduled',
 				game_type='remote',
 				tournament=self,
+				round_number=self.current_round - 1,
 			)
-			GameManager.create_game(game.id)
-			game_dict[game.id] = (player1.id, player2.id)
-			logger.info(f'Game created: {game.id} with players {player1.id} and {player2.id}')
-			self.games.add(game)
+			for player1, player2 in zip(players[0::2], players[1::2])
+		])
+		self.games.through.objects.bulk_create([self.games.through(tournament=self, game=game) for game in games])
+		GameManager.create_games([game.id for game in games])
+		game_dict = {game.id: (game.player1_id, game.player2_id) for game in games}
 		logger.info(f'Generated game_dict: {game_dict}')
 		return game_dict
 
@@ -190,26 +227,11 @@ class Tournament(models.Model):
 #conditions sont réunies pour la mettre à jour soit rien n'est fait
 #cela permet de ne pas avoir des matchs a différents stade
 	def advance_tournament_round(self):
-		from server_side_pong.consumers.consumers import GameManager
-
 		with transaction.atomic():
-			# Log all games
-			all_games = list(self.games.all())  # Ensure immediate evaluation
-			for game in all_games:
-				logger.info(f"games in advance: {game}, id: {game.id}, round number: {game.round_number}, current_round: {self.current_round}")
-
 			# Fetch and process previous round games
 			previous_round_games = self.games.filter(round_number=self.current_round - 1, status='completed').select_related('winner')
-			logger.info(f"previous_round_games??? in advance tournament: {previous_round_games}")
-
-			# Refresh and log each game
-			winners = []
-			for game in previous_round_games:
-				game.refresh_from_db()  # Ensure up-to-date data
-				logger.info(f"game {game.id} winner: {game.winner}")
-				if game.winner:
-					winners.append(game.winner)
 
+			winners = [game.winner for game in previous_round_games if game.winner]
 			logger.info(f"Winners in advance tournament: {winners}")
 
 			logger.info(f"bye player in advance tournament: {self.bye_player}")
@@ -234,27 +256,7 @@ class Tournament(models.Model):
 				self.save()
 
 				random.shuffle(winners)
-
-				game_dict = {}
-				for i in range(0, len(winners), 2):
-					player1 = winners[i]
-					player2 = winners[i + 1]
-					game = Game.objects.create(
-						name=f'{self.name}, round {self.current_round} with {player1.nickname} vs {player2.nickname}',
-						rounds_needed=3,
-						player1=player1,
-						player2=player2,
-						created_by=player1,
-						status='scheduled',
-						tournament=self,
-						round_number=self.current_round - 1,
-					)
-					GameManager.create_game(game.id)
-					game_dict[game.id] = (player1.id, player2.id)
-					self.games.add(game)
-					logger.info(f'Game created: {game.id} with players {player1.id} and {player2.id}')
-				logger.info(f'Generated game_dict: {game_dict}')
-				return game_dict
+				return self.create_round_games(winners)
 
 class TournamentInvitation(models.Model):
 	tournament = models.ForeignKey(Tournament, related_name='tournament_invitation_set', on_delete=models.CASCADE)
@@ -0,0 +1,238 @@
+"""
+Start of a tournament round, as a state machine driven by Celery ETA tasks.
+
+A round goes through these stages, each one run by the tournament_step task once its
+delay has passed. No worker waits in between, so any number of tournaments can be at
+any stage at the same time:
+
+	READY_CHECK (before the first round only): participants pinged, their answers are
+	checked -> the matches are generated -> COUNTDOWN
+	COUNTDOWN: players told their opponent, COUNTDOWN_DURATION seconds later they are pinged
+	again -> GAME_CHECK
+	GAME_CHECK: answers checked -> game ids sent, the round is played (see
+	signals.check_tournament_progress for the next one)
+
+A check runs as soon as the last participant answered the ping (record_response), or
+RESPONSE_TIMEOUT seconds after it at the latest; missing answers cancel the tournament. Each (tournament, round, stage) runs
+once: a step delivered twice, or a beat picking up a tournament already starting, does
+nothing the second time.
+"""
+import asyncio, json, logging, time
+from typing import NamedTuple
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from hello_django.redis_clients import get_redis, get_async_redis
+from .models import Player, Tournament
+
+logger = logging.getLogger(__name__)
+
+LAUNCH = "launch"
+READY_CHECK = "ready_check"
+COUNTDOWN = "countdown"
+GAME_CHECK = "game_check"
+
+RESPONSE_TIMEOUT = 3 # seconds the participants have at most to answer a ping
+COUNTDOWN_DURATION = 5 # seconds between the opponents announcement and the games
+STAGE_TTL = 60 # seconds a stage stays claimed, well above the longest stage
+
+BEFORE_START_MESSAGE = "Somebody disconnected before the start of the tournament, sorry :/"
+DURING_MESSAGE = "Somebody disconnected during the tournament, sorry :/"
+BYE_MESSAGE = "The tournament started with an odd number of players and you gotta wait, sorry :/"
+
+
+def barrier_keys(tournament_id):
+	"""
+	Keys of the ping in progress: a hash with the time it was sent and the stage waiting
+	for it, the set of the participants expected to answer, and a hash of the answers
+	(participant id -> seconds it took).
+	"""
+	return (
+		f"tournament_barrier_{tournament_id}",
+		f"tournament_expected_{tournament_id}",
+		f"tournament_responses_{tournament_id}",
+	)
+
+
+class Readiness(NamedTuple):
+	responded: dict # participant id -> seconds between the ping and the answer
+	missing: set
+
+
+def claim_stage(tournament_id, round_number, stage):
+	"""True for the first caller only."""
+	key = f"tournament_stage_{tournament_id}_{round_number}_{stage}"
+	return bool(get_redis().set(key, 1, nx=True, ex=STAGE_TTL))
+
+
+def schedule(tournament_id, round_number, stage, delay, games=None):
+	from .tasks import tournament_step
+	tournament_step.apply_async((tournament_id, round_number, stage, games), countdown=delay)
+
+
+def dispatch(messages):
+	"""Send every (player_id, message) of messages to the user's group, all at once."""
+	if messages:
+		async_to_sync(adispatch)(messages)
+
+
+async def adispatch(messages):
+	# one trip from the worker to the event loop, the sends share the channel layer's connections
+	channel_layer = get_channel_layer()
+	await asyncio.gather(*(
+		channel_layer.group_send(f"user_{player_id}", message) for player_id, message in messages
+	))
+
+
+def ready_check(tournament, round_number, stage, games=None):
+	"""Ping every participant; `stage` runs once they all answered, RESPONSE_TIMEOUT seconds from now at the latest."""
+	participant_ids = list(tournament.participants.values_list("id", flat=True))
+	barrier, expected, responses = barrier_keys(tournament.id)
+	pipe = get_redis().pipeline()
+	pipe.delete(barrier, expected, responses)
+	pipe.hset(barrier, mapping={"started": time.time(), "step": json.dumps([round_number, stage, games])})
+	pipe.sadd(expected, *participant_ids)
+	pipe.expire(barrier, STAGE_TTL)
+	pipe.expire(expected, STAGE_TTL)
+	pipe.execute()
+	dispatch([
+		(participant_id, {
+			"type": "ping",
+			"ping_type": "tournament_ping",
+			"ping_id": tournament.id
+		})
+		for participant_id in participant_ids
+	])
+	schedule(tournament.id, round_number, stage, RESPONSE_TIMEOUT, games)
+
+
+async def record_response(tournament_id, user_id):
+	"""A participant answered the ping (ChatConsumer.handle_ping_response); the last answer runs the waiting stage now."""
+	redis_client = get_async_redis()
+	barrier, expected, responses = barrier_keys(tournament_id)
+	pipe = redis_client.pipeline(transaction=False)
+	pipe.hmget(barrier, "started", "step")
+	pipe.sismember(expected, user_id)
+	(started, step), is_expected = await pipe.execute()
+	if started is None or not is_expected:
+		return
+
+	# in a transaction, so exactly one answer sees the count complete
+	pipe = redis_client.pipeline()
+	pipe.hsetnx(responses, user_id, time.time() - float(started))
+	pipe.expire(responses, STAGE_TTL)
+	pipe.hlen(responses)
+	pipe.scard(expected)
+	added, _, count, needed = await pipe.execute()
+	if added and count == needed:
+		round_number, stage, games = json.loads(step)
+		await sync_to_async(schedule)(tournament_id, round_number, stage, 0, games)
+
+
+def collect_responses(tournament):
+	"""Close the ping in progress and report who answered it, and how fast."""
+	barrier, expected, responses = barrier_keys(tournament.id)
+	pipe = get_redis().pipeline()
+	pipe.hgetall(responses)
+	pipe.delete(barrier, expected, responses)
+	answers, _ = pipe.execute()
+	responded = {int(user_id): float(seconds) for user_id, seconds in answers.items()}
+	missing = set(tournament.participants.values_list("id", flat=True)) - set(responded)
+
+	slowest = max(responded.values(), default=0)
+	logger.info(
+		f"Tournament {tournament.name}: {len(responded)} of {len(responded) + len(missing)} participants "
+		f"responded, the slowest in {slowest:.3f}s, "
+		+ ", ".join(f"{user_id}: {seconds:.3f}s" for user_id, seconds in sorted(responded.items()))
+	)
+	if missing:
+		logger.warning(f"Participants {sorted(missing)} did not respond for tournament: {tournament.name}")
+	return Readiness(responded, missing)
+
+
+def system_message(player_id, username, tournament, message):
+	return (player_id, {
+		"type": "notification",
+		"notification": "systemMessage",
+		"message": message,
+		"senderID": player_id,
+		"senderName": username,
+		"recipientID": player_id,
+		"requestID": tournament.id,
+		"notificationID": -1
+	})
+
+
+def cancel(tournament, message):
+	dispatch([
+		system_message(player_id, username, tournament, message)
+		for player_id, username in tournament.participants.values_list("id", "user__username")
+	])
+	tournament.delete()
+
+
+def game_messages(tournament, games, message):
+	"""Messages telling each player of games ([game_id, player1_id, player2_id]) its game and its opponent."""
+	player_ids = [player_id for _, player1_id, player2_id in games for player_id in (player1_id, player2_id)]
+	usernames = dict(Player.objects.filter(id__in=player_ids).values_list("id", "user__username"))
+	return [
+		(player_id, {
+			"type": "tournament_update",
+			"message": message,
+			"game_id": game_id,
+			"opponent_name": usernames[opponent_id],
+			"tourney_id": tournament.id
+		})
+		for game_id, player1_id, player2_id in games
+		for player_id, opponent_id in ((player1_id, player2_id), (player2_id, player1_id))
+	]
+
+
+def begin(tournament):
+	"""Called by launch_tournaments for a tournament due to start."""
+	if not claim_stage(tournament.id, tournament.current_round, LAUNCH):
+		return
+	logger.info(f"Starting tournament: {tournament.name}")
+	ready_check(tournament, tournament.current_round, READY_CHECK)
+
+
+def start_round(tournament, game_dict):
+	"""Announce the games of game_dict ({game_id: (player1_id, player2_id)}), then wait COUNTDOWN_DURATION."""
+	games = [[game_id, player1_id, player2_id] for game_id, (player1_id, player2_id) in game_dict.items()]
+	dispatch(game_messages(tournament, games, "start_countdown"))
+	schedule(tournament.id, tournament.current_round, COUNTDOWN, COUNTDOWN_DURATION, games)
+
+
+def run_stage(tournament_id, round_number, stage, games=None):
+	"""The stage of the round is over: check its outcome and move to the next one."""
+	tournament = Tournament.objects.select_related("bye_player__user").filter(id=tournament_id).first()
+	if tournament is None or tournament.current_round != round_number:
+		logger.info(f"Tournament {tournament_id} moved on, dropping its {stage} step of round {round_number}")
+		return
+	if not claim_stage(tournament_id, round_number, stage):
+		return
+
+	if stage == READY_CHECK:
+		if collect_responses(tournament).missing:
+			cancel(tournament, BEFORE_START_MESSAGE)
+			return
+		tournament.status = 'ongoing'
+		game_dict = tournament.generate_initial_matches()
+		tournament.save()
+		logger.info(f"The tournament {tournament.name} is ready to start.")
+		start_round(tournament, game_dict)
+
+	elif stage == COUNTDOWN:
+		ready_check(tournament, round_number, GAME_CHECK, games)
+
+	elif stage == GAME_CHECK:
+		if collect_responses(tournament).missing:
+			cancel(tournament, DURING_MESSAGE)
+			return
+		messages = game_messages(tournament, games, "")
+		if tournament.bye_player:
+			bye_player = tournament.bye_player
+			messages.append(system_message(bye_player.id, bye_player.user.username, tournament, BYE_MESSAGE))
+		dispatch(messages)
+
+	else:
+		raise ValueError(f"Unknown tournament stage {stage}.")
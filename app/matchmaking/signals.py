@@ -1,6 +1,8 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, When
 from .models import Player, PlayerStatistics
 from server_side_pong.models import Game
 
@@ -39,9 +41,19 @@ def check_tournament_progress(sender, instance, **kwargs):
 @receiver(post_save, sender=Game)
 def update_player_statistics(sender, instance, **kwargs):
     # Mettre à jour les statistiques des joueurs après un match
-    for player in [instance.player1, instance.player2]:
-        if player is not None:
-            stats, created = PlayerStatistics.objects.get_or_create(player=player)
-            stats.matches_played = player.match_history.count()
-            stats.matches_won = player.match_history.filter(winner=player).count()
-            stats.save()
\ No newline at end of file
+    if instance.status != 'completed':
+        return
+    player_ids = [player_id for player_id in (instance.player1_id, instance.player2_id) if player_id is not None]
+    with transaction.atomic():
+        # a player whose row is missing still gets the game counted
+        PlayerStatistics.objects.bulk_create([PlayerStatistics(player_id=player_id) for player_id in player_ids], ignore_conflicts=True)
+        # statistics rows locked before the game, in the same order as PlayerStatistics.objects.reconcile()
+        list(PlayerStatistics.objects.select_for_update().filter(player_id__in=player_ids).order_by('player_id').values_list('id', flat=True))
+        # only the first save seeing the game completed flips the flag, so a game is counted once
+        if not Game.objects.filter(id=instance.id, stats_recorded=False).update(stats_recorded=True):
+            return
+        instance.stats_recorded = True
+        PlayerStatistics.objects.filter(player_id__in=player_ids).update(
+            matches_played=F('matches_played') + 1,
+            matches_won=F('matches_won') + Case(When(player_id=instance.winner_id, then=1), default=0),
+        )
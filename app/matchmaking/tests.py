@@ -1,11 +1,16 @@
 # matchmaking/tests.py
+from unittest import mock
+from django.test import TestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from django.contrib.auth import get_user_model
-from .models import Tournament, Player, TournamentInvitation
+from .models import Tournament, Player, PlayerStatistics, TournamentInvitation
 from django.utils import timezone
 from server_side_pong.models import Game
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from . import orchestration
 
 User = get_user_model()
 
@@ -277,3 +282,244 @@ def test_player_statistics(self):
     self.assertEqual(stats.matches_won, 1)
     self.assertEqual(stats.matches_lost, 1)
     self.assertEqual(stats.win_rate, 50)
+
+
+class FakeRedis:
+    """The few commands of the tournament orchestration, in memory, replying bytes like Redis."""
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update((str(field).encode(), str(value).encode()) for field, value in mapping.items())
+
+    def hsetnx(self, key, field, value):
+        fields = self.data.setdefault(key, {})
+        if str(field).encode() in fields:
+            return 0
+        fields[str(field).encode()] = str(value).encode()
+        return 1
+
+    def hmget(self, key, *fields):
+        return [self.data.get(key, {}).get(field.encode()) for field in fields]
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hlen(self, key):
+        return len(self.data.get(key, {}))
+
+    def sadd(self, key, *values):
+        self.data.setdefault(key, set()).update(str(value).encode() for value in values)
+
+    def sismember(self, key, value):
+        return str(value).encode() in self.data.get(key, set())
+
+    def scard(self, key):
+        return len(self.data.get(key, set()))
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+class AsyncFakeRedis:
+    def __init__(self, redis):
+        self.redis = redis
+
+    def pipeline(self, transaction=True):
+        pipeline = FakePipeline(self.redis)
+        execute = pipeline.execute
+
+        async def aexecute():
+            return execute()
+        pipeline.__dict__['execute'] = aexecute
+        return pipeline
+
+
+class TournamentOrchestrationTests(TestCase):
+    def setUp(self):
+        self.players = [
+            Player.objects.get(user=User.objects.create_user(username=f'orch{n}', email=f'orch{n}@example.com', password='pass'))
+            for n in range(3)
+        ]
+        self.tournament = Tournament.objects.create(name='Orchestrated', start_time=timezone.now(), created_by=self.players[0])
+        self.tournament.participants.add(*self.players)
+
+        self.redis = FakeRedis()
+        self.sent = []
+        self.scheduled = []
+        for target, replacement in (
+            ('matchmaking.orchestration.get_redis', lambda: self.redis),
+            ('matchmaking.orchestration.get_async_redis', lambda: AsyncFakeRedis(self.redis)),
+            ('matchmaking.orchestration.dispatch', self.sent.extend),
+            ('matchmaking.orchestration.schedule', lambda *args: self.scheduled.append(args)),
+            ('server_side_pong.consumers.consumers.GameManager.create_games', lambda game_ids: None),
+        ):
+            patcher = mock.patch(target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def respond(self, *players):
+        for player in players:
+            async_to_sync(orchestration.record_response)(self.tournament.id, player.id)
+
+    def messages(self, kind):
+        sent = [(player_id, message) for player_id, message in self.sent if message['type'] == kind]
+        self.sent[:] = [(player_id, message) for player_id, message in self.sent if message['type'] != kind]
+        return sent
+
+    def test_stages_are_scheduled_instead_of_waited_for(self):
+        orchestration.begin(self.tournament)
+        orchestration.begin(self.tournament)  # next beat while the tournament is starting
+        self.assertEqual(len(self.messages('ping')), 3)
+        self.assertEqual(self.scheduled, [(self.tournament.id, 1, orchestration.READY_CHECK, orchestration.RESPONSE_TIMEOUT, None)])
+
+        self.respond(*self.players)
+        # the last answer runs the check right away, the timeout step comes later and does nothing
+        self.assertEqual(self.scheduled[-1], (self.tournament.id, 1, orchestration.READY_CHECK, 0, None))
+        orchestration.run_stage(self.tournament.id, 1, orchestration.READY_CHECK)
+        orchestration.run_stage(self.tournament.id, 1, orchestration.READY_CHECK)
+        self.tournament.refresh_from_db()
+        self.assertEqual(self.tournament.status, 'ongoing')
+        game = self.tournament.games.get()
+        countdown = self.messages('tournament_update')
+        self.assertEqual(sorted(player_id for player_id, _ in countdown), sorted([game.player1_id, game.player2_id]))
+        self.assertTrue(all(message['message'] == 'start_countdown' for _, message in countdown))
+        games = [[game.id, game.player1_id, game.player2_id]]
+        self.assertEqual(self.scheduled[-1], (self.tournament.id, 1, orchestration.COUNTDOWN, orchestration.COUNTDOWN_DURATION, games))
+        self.scheduled.clear()
+
+        orchestration.run_stage(self.tournament.id, 1, orchestration.COUNTDOWN, games)
+        self.assertEqual(len(self.messages('ping')), 3)
+        self.assertEqual(self.scheduled, [(self.tournament.id, 1, orchestration.GAME_CHECK, orchestration.RESPONSE_TIMEOUT, games)])
+
+        self.respond(*self.players)
+        self.assertEqual(self.scheduled[-1], (self.tournament.id, 1, orchestration.GAME_CHECK, 0, games))
+        orchestration.run_stage(self.tournament.id, 1, orchestration.GAME_CHECK, games)
+        self.assertEqual(len(self.scheduled), 2)
+        self.assertEqual([message['message'] for _, message in self.messages('tournament_update')], ['', ''])
+        self.assertEqual(self.messages('notification')[0][0], self.tournament.bye_player_id)
+
+    def test_missing_response_cancels_the_tournament(self):
+        outsider = Player.objects.get(user=User.objects.create_user(username='outsider', email='outsider@example.com', password='pass'))
+        orchestration.begin(self.tournament)
+        self.respond(self.players[0], self.players[1], self.players[1], outsider)
+        self.assertEqual(len(self.scheduled), 1)  # still waiting for the third participant
+
+        with self.assertLogs('matchmaking.orchestration') as logs:
+            orchestration.run_stage(self.tournament.id, 1, orchestration.READY_CHECK)
+        self.assertIn('2 of 3 participants responded', logs.output[0])
+        self.assertIn(f'[{self.players[2].id}] did not respond', logs.output[1])
+
+        self.assertFalse(Tournament.objects.filter(id=self.tournament.id).exists())
+        cancelled = self.messages('notification')
+        self.assertEqual(len(cancelled), 3)
+        self.assertEqual(cancelled[0][1]['message'], orchestration.BEFORE_START_MESSAGE)
+
+    def test_round_messages_are_built_in_one_query_and_sent_together(self):
+        games = [[1, self.players[0].id, self.players[1].id]]
+        with self.assertNumQueries(1):
+            messages = orchestration.game_messages(self.tournament, games, 'start_countdown')
+        self.assertEqual(
+            [(player_id, message['opponent_name']) for player_id, message in messages],
+            [(self.players[0].id, 'orch1'), (self.players[1].id, 'orch0')],
+        )
+
+        layer = InMemoryChannelLayer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f'user_{self.players[1].id}', channel)
+        with mock.patch('matchmaking.orchestration.get_channel_layer', return_value=layer):
+            async_to_sync(orchestration.adispatch)(messages)
+        self.assertEqual(async_to_sync(layer.receive)(channel)['opponent_name'], 'orch0')
+
+
+class BracketGenerationTests(TestCase):
+    def test_a_round_is_created_in_a_few_queries(self):
+        players = [
+            Player.objects.get(user=User.objects.create_user(username=f'bracket{n}', email=f'bracket{n}@example.com', password='pass'))
+            for n in range(20)
+        ]
+        tournament = Tournament.objects.create(name='Bracket', start_time=timezone.now(), created_by=players[0])
+        tournament.participants.add(*players)
+
+        with mock.patch('server_side_pong.consumers.consumers.GameManager.create_games') as create_games:
+            with self.assertNumQueries(3):  # participants, games, tournament links
+                game_dict = tournament.generate_initial_matches()
+
+        self.assertEqual(len(game_dict), 10)
+        create_games.assert_called_once_with(list(game_dict))
+        games = tournament.games.order_by('id')
+        self.assertEqual([game.id for game in games], list(game_dict))
+        self.assertTrue(all(game.status == 'scheduled' and game.round_number == 0 for game in games))
+        paired = [player_id for pair in game_dict.values() for player_id in pair]
+        self.assertEqual(sorted(paired), sorted(player.id for player in players))
+
+
+class PlayerStatisticsTests(TestCase):
+    def setUp(self):
+        self.player1, self.player2 = (
+            Player.objects.get(user=User.objects.create_user(username=f'stats{n}', email=f'stats{n}@example.com', password='pass'))
+            for n in range(2)
+        )
+
+    def stats(self, player):
+        stats = PlayerStatistics.objects.get(player=player)
+        return stats.matches_played, stats.matches_won
+
+    def test_a_game_is_counted_once_when_it_completes(self):
+        game = Game.objects.create(name='Stats', player1=self.player1, player2=self.player2, rounds_needed=3, game_type='remote')
+        game.status = 'ongoing'
+        game.save()
+        self.assertEqual(self.stats(self.player1), (0, 0))
+
+        game.status = 'completed'
+        game.winner = self.player2
+        # the game, then in a savepoint: the missing rows, the row locks, the flag and one UPDATE for both players
+        with self.assertNumQueries(7):
+            game.save()
+        game.save()
+        Game.objects.get(id=game.id).save()
+        self.assertEqual(self.stats(self.player1), (1, 0))
+        self.assertEqual(self.stats(self.player2), (1, 1))
+
+    def test_a_player_without_statistics_gets_the_game_counted(self):
+        PlayerStatistics.objects.filter(player=self.player2).delete()
+        Game.objects.create(name='Stats', player1=self.player1, player2=self.player2, rounds_needed=3, game_type='remote', status='completed', winner=self.player2)
+        self.assertEqual(self.stats(self.player1), (1, 0))
+        self.assertEqual(self.stats(self.player2), (1, 1))
+
+    def test_reconcile_fixes_the_drift(self):
+        Game.objects.create(name='Counted', player1=self.player1, player2=self.player2, rounds_needed=3, game_type='remote', status='completed', winner=self.player1)
+        # written without signals, never counted
+        Game.objects.bulk_create([Game(name='Missed', player1=self.player1, player2=self.player2, rounds_needed=3, game_type='remote', status='completed', winner=self.player2)])
+        PlayerStatistics.objects.filter(player=self.player2).update(matches_won=7)
+
+        with self.assertLogs('matchmaking.models', 'WARNING'):
+            self.assertEqual(PlayerStatistics.objects.reconcile(), 2)
+        self.assertEqual(self.stats(self.player1), (2, 1))
+        self.assertEqual(self.stats(self.player2), (2, 1))
+        self.assertEqual(PlayerStatistics.objects.reconcile(), 0)
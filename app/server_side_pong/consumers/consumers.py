@@ -1,57 +1,177 @@
-import json, asyncio, logging, sys, random, redis, pickle
+import json, asyncio, logging, sys
+from collections import deque
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
 from django.utils import timezone  # To set the start time
 from django.apps import apps #fix les probleme d'import
+from django.conf import settings
 from channels.layers import get_channel_layer
-from .utils import get_or_create_guest_player, adjust_ball_velocity
+from hello_django.redis_clients import get_redis, get_async_redis, get_async_script
+from .utils import get_or_create_guest_player
+from .physics import VXSPEED, VYSPEED, slide_direction, get_physics_backend
+from .state import GameState, BallState, PaddleState, MatchDescriptor
+from .engine import PongEngine, spawn
+from .protocol import BINARY_SUBPROTOCOL, FRAME_INTERVAL_MS, FrameEncoder
+from .worker import PongWorker
+from .persistence import PersistenceQueue, MatchResult
+from .simulation import PongSimulation, SERVE_DELAY
+from .replay import ReplayRecorder, replay_key
+from . import metrics
 import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-PADDLE_SPEED = 3
-BALL_SPEED = 1.05
-BALL_RADIUS = 1.5
-SCREEN_WIDTH = 160
-SCREEN_HEIGHT = 90
-PADDLE_HEIGHT = 15
 ROUND_NEEDED = 5
-EPSILON = 1e-2
-BALL_SPEED_STEP = 1.05
-VXSPEED = 1
-VYSPEED = 0.9
+TICK_RATE = 60
+MAX_CATCHUP = 5 # max fixed steps simulated in one frame when the loop is late, the rest is skipped
+OWNER_TTL = 15 # seconds an ownership record survives a worker that stopped refreshing it
+OWNER_HEARTBEAT = 5 # seconds between two refreshes of the ownership record by the running game
+MAX_QUEUED_INPUTS = 64 # per game, between two ticks
+
+# Redis keys: the state hash of a game and the worker owning it
+GAME_KEY_PREFIX = "pong:game:"
+OWNER_KEY_PREFIX = "pong:owner:"
+FINISHED_TTL = 60 # seconds the Redis state of a finished game is kept
+
+# Seats a user in the first free role of a game, in one atomic step.
+# KEYS[1]: hash of the game, ARGV[1]: user id. Returns the role, or why the user was not seated.
+JOIN_GAME_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 'missing'
+end
+local seats = redis.call('HMGET', KEYS[1], 'player1', 'player2')
+if seats[1] == ARGV[1] or seats[2] == ARGV[1] then
+    return 'joined'
+end
+for i, role in ipairs({'player1', 'player2'}) do
+    if not seats[i] then
+        redis.call('HSET', KEYS[1], role, ARGV[1])
+        return role
+    end
+end
+return 'full'
+"""
 
 logger = logging.getLogger(__name__)
 class GameManager:
-    redis_client = redis.StrictRedis(host="redis", port=6380, db=0)
+    """
+    Games stored in Redis and the instances running in this process.
+
+    Every storage method has a sync version for views, models and Celery tasks, and an
+    async one ("a" prefix, like Django's aget/asave) for consumers and the game loop,
+    backed by the pooled asyncio client of the process so Redis never blocks the event loop.
+    """
+    redis_client = get_redis()
+    join_game_script = redis_client.register_script(JOIN_GAME_SCRIPT)
     _instances = {}  # In-memory cache for TwoPlayerPong instances
+    persistence = PersistenceQueue()  # results of the games that ended in this process
+    background_tasks = set()  # tasks started by the class methods and still running
+    # advances every game of this process
+    engine = PongEngine(
+        TICK_RATE, MAX_CATCHUP, get_physics_backend(settings.PONG_PHYSICS_BACKEND, settings.PONG_IN_MEMORY_STATE),
+        spectator_rate=settings.PONG_SPECTATOR_RATE, tick_budget=settings.PONG_TICK_BUDGET,
+    )
+
+    @staticmethod
+    def new_game_state():
+        return GameState(
+            BallState(80, 45, VXSPEED, VYSPEED),
+            PaddleState(10, 36.5),
+            PaddleState(150, 36.5),
+        )
+
+    @staticmethod
+    def game_key(game_id):
+        return f"{GAME_KEY_PREFIX}{game_id}"
 
     @classmethod
     def create_game(cls, game_id):
-        game_state = {
-            "ball": { "x": 80, "y": 45, "vx": VXSPEED, "vy": VYSPEED },
-            "players": {
-                "player1": { "x": 10, "y": 36.5, "slide" : None},
-                "player2": { "x": 150, "y": 36.5, "slide" : None},
-            },
-            "scores": { "player1": 0, "player2": 0 },
-        }
-        cls.redis_client.set(game_id, pickle.dumps(game_state))
+        cls.create_games([game_id])
+
+    @classmethod
+    def create_games(cls, game_ids):
+        """Initial state of every game of game_ids, in one round trip."""
+        mapping = cls.new_game_state().to_hash()
+        pipe = cls.redis_client.pipeline()
+        for game_id in game_ids:
+            pipe.hset(cls.game_key(game_id), mapping=mapping)
+            pipe.expire(cls.game_key(game_id), settings.PONG_GAME_TTL)
+        pipe.execute()
+
+    @classmethod
+    async def acreate_game(cls, game_id):
+        pipe = get_async_redis().pipeline()
+        pipe.hset(cls.game_key(game_id), mapping=cls.new_game_state().to_hash())
+        pipe.expire(cls.game_key(game_id), settings.PONG_GAME_TTL)
+        await pipe.execute()
+
+    @classmethod
+    def delete_game(cls, game_id):
+        cls.redis_client.delete(cls.game_key(game_id))
+
+    @classmethod
+    async def adelete_game(cls, game_id):
+        await get_async_redis().delete(cls.game_key(game_id))
 
     @classmethod
     def get_game_state(cls, game_id):
-        game_data = cls.redis_client.get(game_id)
-        if game_data is None:
+        game_data = cls.redis_client.hgetall(cls.game_key(game_id))
+        if not game_data:
             raise ValueError(f"Game {game_id} not found.")
-        pickle.loads(game_data)
         # logger.info(f"Fetched game state for {game_id}: {game_state}")
-        return pickle.loads(game_data)
+        return GameState.from_hash(game_data)
+
+    @classmethod
+    async def aget_game_state(cls, game_id):
+        game_data = await get_async_redis().hgetall(cls.game_key(game_id))
+        if not game_data:
+            raise ValueError(f"Game {game_id} not found.")
+        return GameState.from_hash(game_data)
+
+    @staticmethod
+    def score_field(role):
+        return "score1" if role == "player1" else "score2"
+
+    @classmethod
+    async def arefresh_games(cls, games):
+        """Reload, in one round trip, the games for which Redis is authoritative and which have nothing left to write."""
+        stale = [game for game in games if not game.in_memory and not game.has_pending_writes()]
+        if not stale:
+            return
+        pipe = get_async_redis().pipeline(transaction=False)
+        for game in stale:
+            pipe.hgetall(cls.game_key(game.game_id))
+        metrics.REDIS_COMMANDS.inc(len(stale))
+        for game, game_data in zip(stale, await pipe.execute()):
+            if game_data:
+                game.game_state = GameState.from_hash(game_data)
 
     @classmethod
-    def save_game_state(cls, game_id, game_state):
-        # logger.info(f"Saving game state for {game_id}: {game_state}")
-        cls.redis_client.set(game_id, pickle.dumps(game_state))
+    async def aflush_games(cls, games):
+        """
+        Write the pending checkpoints, points and ownership heartbeats of the games in one
+        round trip. Every write also pushes back the expiry of the game key, so the state
+        of a running game never expires while an abandoned one does.
+        """
+        pipe = get_async_redis().pipeline(transaction=False)
+        for game in games:
+            key = cls.game_key(game.game_id)
+            if not game.has_pending_writes() and not game.heartbeat_due:
+                continue
+            if game.dirty:
+                pipe.hset(key, "bodies", game.game_state.bodies_to_bytes())
+                game.dirty = False
+            for role in game.pending_points:
+                pipe.hincrby(key, cls.score_field(role), 1)
+            game.pending_points.clear()
+            pipe.expire(key, settings.PONG_GAME_TTL)
+            if game.heartbeat_due:
+                pipe.expire(cls.owner_key(game.game_id), OWNER_TTL)
+                game.heartbeat_due = False
+        if len(pipe):
+            metrics.REDIS_COMMANDS.inc(len(pipe))
+            await pipe.execute()
 
     @classmethod
     def get_game_instance(cls, game_id):
@@ -61,77 +181,252 @@ class GameManager:
         return cls._instances[game_id]
 
     @classmethod
-    def start_game(cls, game_id):
-        """Start the game loop for the given game ID."""
-        game_instance = cls.get_game_instance(game_id)
-      #  game_state = GameManager.get_game_state(game_id)
-      #  player1_id = game_state["players"]["player1"]["user_id"]
-        """ asyncio.create_task(game_instance.check_tournament(player1_id))
-        time.sleep(1) """
-        asyncio.create_task(game_instance.start_game_loop())
+    async def aget_game_instance(cls, game_id):
+        if game_id not in cls._instances:
+            game_state = await cls.aget_game_state(game_id)
+            # another coroutine may have built it while we were waiting for Redis
+            cls._instances.setdefault(game_id, TwoPlayerPong(game_id, game_state))
+        return cls._instances[game_id]
+
+    @staticmethod
+    def owner_key(game_id):
+        return f"{OWNER_KEY_PREFIX}{game_id}"
+
+    @classmethod
+    def get_owner(cls, game_id):
+        """Channel name of the worker running the game, None if it runs nowhere."""
+        owner = cls.redis_client.get(cls.owner_key(game_id))
+        return owner.decode() if owner is not None else None
+
+    @classmethod
+    async def aget_owner(cls, game_id):
+        owner = await get_async_redis().get(cls.owner_key(game_id))
+        return owner.decode() if owner is not None else None
+
+    @classmethod
+    async def claim_game(cls, game_id):
+        """Record this worker as the owner of the game, unless another one already runs it. Returns the owner."""
+        me = await cls.worker.get_channel_name()
+        while True:
+            if await get_async_redis().set(cls.owner_key(game_id), me, nx=True, ex=OWNER_TTL):
+                return me
+            owner = await cls.aget_owner(game_id)
+            if owner is not None:
+                return owner
+            # the record expired in between, try again
+
+    @classmethod
+    def release_game(cls, game_id):
+        if cls.worker.channel_name is not None and cls.get_owner(game_id) == cls.worker.channel_name:
+            cls.redis_client.delete(cls.owner_key(game_id))
+
+    @classmethod
+    async def arelease_game(cls, game_id):
+        if cls.worker.channel_name is not None and await cls.aget_owner(game_id) == cls.worker.channel_name:
+            await get_async_redis().delete(cls.owner_key(game_id))
+
+    @classmethod
+    async def start_game(cls, game_id):
+        """
+        Start the game loop for the given game ID on the worker owning the game.
+
+        The first worker to start a game owns it; a start on any other worker is
+        forwarded to the owner, so there is never a second TwoPlayerPong running
+        the same game in another process.
+        """
+        owner = await cls.claim_game(game_id)
+        if owner != cls.worker.channel_name:
+            logger.info(f"Game {game_id} runs on {owner}, forwarding the start")
+            await cls.worker.send(owner, {"type": "game.start", "game_id": game_id})
+            return
+        await cls.start_local_game(game_id)
+
+    @classmethod
+    async def start_local_game(cls, game_id):
+        game_instance = await cls.aget_game_instance(game_id)
+        if not game_instance.running:
+            # players joined through Redis since the instance was built
+            await game_instance.load_state()
+            if game_instance.match is None:
+                await game_instance.load_match()
+        cls.engine.add(game_instance)
 
     @classmethod
-    def stop_game(cls, game_id):
-        """Stop the game loop for the given game ID."""
+    async def stop_game(cls, game_id):
+        """Stop the game loop for the given game ID, on the worker owning it."""
         if game_id in cls._instances:
             game_instance = cls._instances[game_id]
             logger.info(f"Game_instance_loop id {game_id} has been stopped and killed due to disconnection")
-            asyncio.create_task(game_instance.stop_game_loop())
-            del cls._instances[game_id]
+            spawn(cls.background_tasks, game_instance.stop_game_loop(), f"Stop of game {game_id}")
+            await game_instance.save_replay(archive=True)
+            await cls.adiscard_game(game_id)
+            return
+        owner = await cls.aget_owner(game_id)
+        if owner is not None and owner != cls.worker.channel_name:
+            await cls.worker.send(owner, {"type": "game.stop", "game_id": game_id})
+        else:
+            # never started: only the Redis state is left
+            await cls.adelete_game(game_id)
+
+    @staticmethod
+    def spectator_group(game_id):
+        return f"spectate_{game_id}"
 
     @classmethod
-    def add_player(cls, game_id, user_id):
-        """Add a player to the game and assign a role."""
-        logger.info(f"Attempting to add player {user_id} to game ID: {game_id}")
-        game_state = cls.get_game_state(game_id)
+    async def abroadcast_state(cls, game_id, state):
+        """Send a one-off message (end of the game, disconnection) to the players and the spectators."""
+        channel_layer = get_channel_layer()
+        message = {"type": "broadcast_game_state", "state": state}
+        await asyncio.gather(
+            channel_layer.group_send(f"game_{game_id}", message),
+            channel_layer.group_send(cls.spectator_group(game_id), message),
+        )
 
-        # Check if the player is already in the game
-        existing_roles = [role for role in game_state["players"] if "user_id" in game_state["players"][role]]
-        if user_id in [game_state["players"][role]["user_id"] for role in existing_roles]:
-            logger.warning(f"Player {user_id} is already in the game ID: {game_id}")
-            raise ValueError("Player is already in the game")
+    @classmethod
+    async def aget_match(cls, game_id):
+        """MatchDescriptor of a game: the Game row and both players in one query."""
+        Game = apps.get_model('server_side_pong', 'Game')
+        game = await Game.objects.select_related("player1", "player2").aget(id=game_id)
+        return MatchDescriptor.from_game(game)
 
-        # Assign roles dynamically
-        if "user_id" not in game_state["players"]["player1"]:
-            role = "player1"
-        elif "user_id" not in game_state["players"]["player2"]:
-            role = "player2"
+    @classmethod
+    async def afinish_game(cls, game_id, winner_id):
+        """
+        Record the winner in the Redis state of a game that just ended and forget the game
+        in this process. The state is kept for FINISHED_TTL seconds only, long enough for
+        the consumers to tell a finished game from a forfeit before the database has it.
+        """
+        cls._instances.pop(game_id, None)
+        cls.engine.remove(game_id)
+        await cls.arelease_game(game_id)
+        pipe = get_async_redis().pipeline()
+        pipe.hset(cls.game_key(game_id), "winner", winner_id)
+        pipe.expire(cls.game_key(game_id), FINISHED_TTL)
+        await pipe.execute()
+
+    @classmethod
+    async def agame_winner(cls, game_id):
+        """Id of the winner of a game that ended in the game loop, None while it is not over."""
+        winner = await get_async_redis().hget(cls.game_key(game_id), "winner")
+        return int(winner) if winner is not None else None
+
+    @classmethod
+    async def adiscard_game(cls, game_id):
+        """Forget a game that is over: its instance, its engine slot, its ownership record and its Redis state."""
+        cls._instances.pop(game_id, None)
+        cls.engine.remove(game_id)
+        await cls.arelease_game(game_id)
+        await cls.adelete_game(game_id)
+
+    @classmethod
+    async def handle_input(cls, game_id, role, data, local=False):
+        """Apply a message of a player to the game, forwarding it when the game runs on another worker."""
+        game_instance = cls._instances.get(game_id)
+        if game_instance is not None and game_instance.running:
+            if local:
+                await game_instance.local_update_state(role, data)
+            else:
+                await game_instance.remote_update_state(role, data)
+            return
+        owner = await cls.aget_owner(game_id)
+        if owner is not None and owner != cls.worker.channel_name:
+            await cls.worker.send(owner, {"type": "game.input", "game_id": game_id, "role": role, "data": data, "local": local})
         else:
+            # the game is not running anywhere yet, the input has nothing to move
+            metrics.INPUTS_DROPPED.inc()
+
+    # Messages forwarded by the other workers, see PongWorker
+    @classmethod
+    async def game_start(cls, message):
+        await cls.start_local_game(message["game_id"])
+
+    @classmethod
+    async def game_stop(cls, message):
+        if message["game_id"] in cls._instances:
+            await cls.stop_game(message["game_id"])
+
+    @classmethod
+    async def game_input(cls, message):
+        if message["game_id"] in cls._instances:
+            await cls.handle_input(message["game_id"], message["role"], message["data"], message["local"])
+
+    @classmethod
+    def joined_role(cls, game_id, user_id, result):
+        """Role returned by JOIN_GAME_SCRIPT, or the ValueError explaining why the user was not seated."""
+        if result == "missing":
+            raise ValueError(f"Game {game_id} not found.")
+        if result == "joined":
+            logger.warning(f"Player {user_id} is already in the game ID: {game_id}")
+            raise ValueError("Player is already in the game")
+        if result == "full":
             logger.error(f"Game with ID {game_id} is full")
             raise ValueError("Game is full")
 
-        # Add the player to the game
-        game_state["players"][role]["user_id"] = user_id
-        cls.save_game_state(game_id, game_state)
-        logger.info(f"Player {user_id} added to game ID: {game_id} with role {role}")
-        return role
+        logger.info(f"Player {user_id} added to game ID: {game_id} with role {result}")
+        return result
+
+    @classmethod
+    def add_player(cls, game_id, user_id):
+        """Add a player to the game and assign a role, atomically (see JOIN_GAME_SCRIPT)."""
+        logger.info(f"Attempting to add player {user_id} to game ID: {game_id}")
+        result = cls.join_game_script(keys=[cls.game_key(game_id)], args=[user_id])
+        return cls.joined_role(game_id, user_id, result.decode())
+
+    @classmethod
+    async def aadd_player(cls, game_id, user_id):
+        logger.info(f"Attempting to add player {user_id} to game ID: {game_id}")
+        join_game_script = get_async_script(JOIN_GAME_SCRIPT)
+        result = await join_game_script(keys=[cls.game_key(game_id)], args=[user_id])
+        return cls.joined_role(game_id, user_id, result.decode())
 
     @classmethod
     def game_exists(cls, game_id):
         """Check if a game exists in Redis."""
-        return cls.redis_client.exists(game_id) > 0
+        return cls.redis_client.exists(cls.game_key(game_id)) > 0
+
+    @classmethod
+    async def agame_exists(cls, game_id):
+        return await get_async_redis().exists(cls.game_key(game_id)) > 0
 
     @classmethod
     def is_user_in_game(cls, game_id, user_id):
         """Check if a user is already in the game."""
-        try:
-            game_state = cls.get_game_state(game_id)
-            return any(
-                "user_id" in game_state["players"][role] and game_state["players"][role]["user_id"] == user_id
-                for role in ["player1", "player2"]
-            )
-        except ValueError as e:
-            logger.error(f"Error checking if user {user_id} is in game {game_id}: {e}")
-            return False
+        seats = cls.redis_client.hmget(cls.game_key(game_id), "player1", "player2")
+        return str(user_id).encode() in seats
 
+    @classmethod
+    async def ais_user_in_game(cls, game_id, user_id):
+        seats = await get_async_redis().hmget(cls.game_key(game_id), "player1", "player2")
+        return str(user_id).encode() in seats
 
-logger = logging.getLogger(__name__)
 
-class TwoPlayerPong:
-    def __init__(self, game_id, game_state):
-        self.game_id = game_id
+# inbox of this process for the messages forwarded to the games it owns
+GameManager.worker = PongWorker(GameManager)
+# the engine reloads and flushes the games through the GameManager around each tick
+GameManager.engine.store = GameManager
+
+class TwoPlayerPong(PongSimulation):
+    def __init__(self, game_id, game_state, seed=None):
+        super().__init__(game_id, game_state, seed)
         self.running = False
-        self.game_state = game_state
+        self.paused = False  # set by the engine while a scored point is being settled
+        # In memory mode the loop owns self.game_state and Redis only gets checkpoints
+        self.in_memory = settings.PONG_IN_MEMORY_STATE
+        self.checkpoint_interval = settings.PONG_CHECKPOINT_INTERVAL
+        self.last_checkpoint = time.monotonic()
+        self.last_heartbeat = time.monotonic()
+        # Redis writes waiting for the engine to flush them after the tick (see GameManager.aflush_games)
+        self.dirty = False
+        self.pending_points = []
+        self.heartbeat_due = False
+        self.encoder = FrameEncoder()  # binary gameplay frames, see protocol.py
+        self.spectator_encoder = FrameEncoder()  # the spectators get fewer frames, so deltas of their own
+        self.replay = ReplayRecorder()  # inputs and keyframes, saved at the end of each round
+        self.recorded_steps = 0  # self.steps when the replay last recorded a tick
+        self.since_broadcast = 0  # ticks since the last frame sent to the players, see PongEngine
+        self.inputs = deque(maxlen=MAX_QUEUED_INPUTS)  # (role, slide, seq, received at) applied by the engine at the next tick
+        self.acks = {"player1": 0, "player2": 0}  # last input sequence number applied for each role
+        self.match = None  # MatchDescriptor, loaded once by load_match() when the game starts
         app_config = apps.get_app_config('server_side_pong')
         self.Game = app_config.get_model('Game')
         app_config_match = apps.get_app_config('matchmaking')
@@ -151,9 +446,34 @@ class TwoPlayerPong:
         else:
             logger.info(f"Player {player1_id} is NOT in an ongoing tournament.") """
 
-    async def start_game_loop(self):
-        self.last_update_time = int(0)
-        channel_layer = get_channel_layer()
+    async def load_state(self):
+        """Reload the state from Redis, whatever the mode."""
+        self.game_state = await GameManager.aget_game_state(self.game_id)
+
+    def checkpoint(self, force=False):
+        """
+        Schedule a save of the state to Redis. In memory mode, only once per checkpoint
+        interval unless forced. Nothing is written here: the engine flushes every game
+        after the tick in one pipelined round trip, so the loop never waits on Redis per game.
+        """
+        now = time.monotonic()
+        if not self.in_memory or force or now - self.last_checkpoint >= self.checkpoint_interval:
+            self.dirty = True
+            self.last_checkpoint = now
+        if self.running and now - self.last_heartbeat >= OWNER_HEARTBEAT:
+            # keep the ownership record alive while the game runs here
+            self.heartbeat_due = True
+            self.last_heartbeat = now
+
+    def has_pending_writes(self):
+        return self.dirty or bool(self.pending_points)
+
+    async def flush(self):
+        """Write what checkpoint() and add_point() scheduled, outside of the engine tick."""
+        await GameManager.aflush_games([self])
+
+    def start(self):
+        """Called by the engine when the game joins it."""
         logger.info(f"Game loop in instance {self.game_id} is starting")
 
         
@@ -163,227 +483,219 @@ class TwoPlayerPong:
             logger.info(f"done delaying first round")
             self.delay_first_round = False """
         self.running = True
-        
-
-
-        time_elapsed = 0
-        update_ball_delay = 3
-        try:
-            while self.running:
-
-                self.game_state = GameManager.get_game_state(self.game_id)
-
-                for role in ["player1","player2"]:
-                    movement = self.game_state["players"][role].get("slide") #get is more error proof than accessing directily => returns None instead of crash if key doesnt exist
-                    if movement == "w" or movement == "ArrowUp":
-                        current_y = self.game_state["players"][role]["y"]
-                        new_y = max(current_y - PADDLE_SPEED, 0)
-                        self.game_state["players"][role]["y"] = new_y
-                    elif movement == "s" or movement == "ArrowDown":
-                        current_y = self.game_state["players"][role]["y"]
-                        new_y = min(current_y + PADDLE_SPEED, SCREEN_HEIGHT - PADDLE_HEIGHT)
-                        self.game_state["players"][role]["y"] = new_y
-
-                GameManager.save_game_state(self.game_id, self.game_state)
-
-                # Update game state
-                if time_elapsed >= update_ball_delay:
-                    await self.update_ball()
-                
-                # Broadcast the updated state
-                await channel_layer.group_send(
-                    f"game_{self.game_id}",
-                    {
-                        "type": "broadcast_game_state",
-                        "state": { "type": "gameplay", "state": self.game_state },
-                    },
-                )
-
-                await asyncio.sleep(1 / 60)  # 60 FPS
-
-                time_elapsed += 1/60
+        self.paused = False
+        self.resync = True
+        self.encoder.request_keyframe()
+        self.spectator_encoder.request_keyframe()
+        self.replay.request_keyframe()
+        self.since_broadcast = 0
+        self.sim_time = 0
+        self.serve_at = SERVE_DELAY
+
+    def frame(self, interval_ms=FRAME_INTERVAL_MS):
+        """
+        The (group, message) pair broadcast by the engine after each tick.
+
+        The frame is encoded once here, consumers only forward it: "frame" is the binary
+        delta frame for the clients that negotiated BINARY_SUBPROTOCOL, "text" the JSON
+        message for the others. Plain strings also keep the channel layer from packing
+        the nested state dict for every group_send. "ack" holds the sequence number of
+        the last input applied for each role, for client side prediction, and "interval"
+        the milliseconds until the next frame, for the clients to interpolate in between
+        when the engine sends fewer frames than it simulates. "sent" is the server's wall
+        clock time of the broadcast, for the clients to measure the delivery latency.
+        """
+        return (
+            f"game_{self.game_id}",
+            {
+                "type": "broadcast_game_state",
+                "text": json.dumps({
+                    "type": "gameplay", "state": self.game_state.to_dict(), "ack": self.acks,
+                    "interval": interval_ms, "sent": time.time(),
+                }),
+                "frame": self.encoder.encode(self.game_state, self.acks, interval_ms),
+            },
+        )
 
-        except asyncio.CancelledError:
-            self.running = False
+    @property
+    def priority(self):
+        """Tournament games keep a higher frame rate when the engine is overloaded."""
+        return self.match is not None and self.match.is_tournament
+
+    def record_tick(self):
+        """Called by the engine after each tick it advanced the game, by one or more steps."""
+        steps = self.steps - self.recorded_steps
+        if steps:
+            self.recorded_steps = self.steps
+            self.replay.tick(self.game_state, steps)
+
+    def spectator_frame(self, interval_ms=FRAME_INTERVAL_MS):
+        """Same as frame() for the spectator group, sent every few ticks only and without the acks."""
+        return (
+            GameManager.spectator_group(self.game_id),
+            {
+                "type": "broadcast_game_state",
+                "text": json.dumps({"type": "gameplay", "state": self.game_state.to_dict(), "interval": interval_ms}),
+                "frame": self.spectator_encoder.encode(self.game_state, interval_ms=interval_ms),
+            },
+        )
 
     async def stop_game_loop(self):
         self.running = False
 
     async def remote_update_state(self, role, data):
         if data["type"] == "gameplay":
-            self.game_state = GameManager.get_game_state(self.game_id)
-            action = data["action"]
-            direction = data["movement"]
             if role in ["player1", "player2"]:
-                if action == "keydown":
-                    self.game_state["players"][role]["slide"] = direction
-                    GameManager.save_game_state(self.game_id, self.game_state)
-                elif action == "keyup":
-                    self.game_state["players"][role]["slide"] = None
-                    GameManager.save_game_state(self.game_id, self.game_state)
+                self.queue_input(role, data)
 
     async def local_update_state(self, exrole, data):
         # logger.info(f"message received as : {data}")
         if data["type"] == "gameplay":
-            self.game_state = GameManager.get_game_state(self.game_id)
-            direction = data["movement"]
             role = data["role"]
-            action = data["action"]
-            if action == "keydown":
-                self.game_state["players"][role]["slide"] = direction
-                GameManager.save_game_state(self.game_id, self.game_state)
-            elif action == "keyup":
-                self.game_state["players"][role]["slide"] = None
-                GameManager.save_game_state(self.game_id, self.game_state)
-
-    async def update_ball(self):
-        self.game_state = GameManager.get_game_state(self.game_id)
-        ball = self.game_state["ball"]
-
-        # Predict the next position of the ball
-        next_x = ball["x"] + ball["vx"]
-        next_y = ball["y"] + ball["vy"]
-
-        # Handle wall collisions (top/bottom)
-        if next_y <= 0 or next_y >= SCREEN_HEIGHT:
-            ball["vy"] = -ball["vy"]
-            next_y = ball["y"] + ball["vy"]  # Update predicted position after collision
-
-        player1 = self.game_state["players"]["player1"]
-        player2 = self.game_state["players"]["player2"]
-
-        #The collision logic works for "grazing" cases because it checks whether the path of the ball intersects with the paddle's boundary, 
-        # rather than relying solely on the ball's exact position (next_x or next_y) during a single frame.
-        # For player1's paddle
-        if (
-            ball["vx"] < 0 and # Ball is moving towards player1's paddle
-            next_x - BALL_RADIUS <= player1["x"] <= ball["x"] + BALL_RADIUS and # Ball's path intersects the paddle's vertical plane
-            player1["y"] <= next_y <= player1["y"] + PADDLE_HEIGHT # Ball's vertical position is within the paddle's range
-        ):
-            ball["vx"] = -ball["vx"]
-            adjust_ball_velocity(ball, player1["y"], PADDLE_HEIGHT, BALL_SPEED_STEP)
-            if next_x - BALL_RADIUS < player1["x"]:
-                next_x = player1["x"] + BALL_RADIUS
-
-        # For player2's paddle
-        if (
-            ball["vx"] > 0 and # Ball is moving towards player2's paddle
-            ball["x"] - BALL_RADIUS <= player2["x"] <= next_x + BALL_RADIUS and # Ball's path intersects the paddle's vertical plane
-            player2["y"] <= next_y <= player2["y"] + PADDLE_HEIGHT # Ball's vertical position is within the paddle's range
-        ):
-            ball["vx"] = -ball["vx"]
-            adjust_ball_velocity(ball, player2["y"], PADDLE_HEIGHT, BALL_SPEED_STEP)
-            if next_x + BALL_RADIUS > player2["x"]:
-                next_x = player2["x"] - BALL_RADIUS
-
-        # Update the ball's position after all collision checks
-        ball["x"] = next_x
-        ball["y"] = next_y
-
-        # if ball["x"] < 10 or ball["x"] > 150:
-        #     logger.info(f"Ball position is x:{ball['x']},y:{ball['y']}")
-
-        GameManager.save_game_state(self.game_id, self.game_state)
-        if ball["x"] <= 0 + EPSILON:
-            self.game_state["scores"]["player2"] += 1
-            GameManager.save_game_state(self.game_id, self.game_state)
-            await self.end_of_round()
-        elif ball["x"] >= SCREEN_WIDTH - EPSILON:
-            self.game_state["scores"]["player1"] += 1
-            GameManager.save_game_state(self.game_id, self.game_state)
-            await self.end_of_round()
+            if role in ["player1", "player2"]:
+                self.queue_input(role, data)
+
+    def queue_input(self, role, data):
+        """Queue a keydown/keyup of a player. Nothing touches the state until the engine drains the queue."""
+        action = data["action"]
+        if action == "keydown":
+            slide = slide_direction(data["movement"])
+        elif action == "keyup":
+            slide = 0
+        else:
+            return
+        if len(self.inputs) == MAX_QUEUED_INPUTS:
+            # the deque drops the oldest one
+            metrics.INPUTS_DROPPED.inc()
+        self.inputs.append((role, slide, data.get("seq"), time.perf_counter()))
+
+    def drain_inputs(self, received=None):
+        """
+        Apply the queued inputs in order, called by the engine at the start of each tick.
+        The time each input was queued at is appended to `received`, if given.
+        Returns whether there was anything to apply.
+        """
+        if not self.inputs:
+            return False
+        while self.inputs:
+            role, slide, seq, received_at = self.inputs.popleft()
+            if received is not None:
+                received.append(received_at)
+            self.game_state.paddle(role).slide = slide
+            self.replay.input(role, slide)
+            if isinstance(seq, int):
+                self.acks[role] = seq
+        self.checkpoint()
+        return True
+
+    def add_point(self, role):
+        # counted in Redis with HINCRBY at the next flush
+        self.pending_points.append(role)
+        self.replay.request_keyframe()
+        super().add_point(role)
+
+    def next_round(self):
+        super().next_round()
+        self.replay.request_keyframe()
+
+    async def save_replay(self, archive=False):
+        """
+        Push the replay records buffered since the last round to Redis, in one compressed
+        chunk. With archive, the whole replay is then moved to the media storage by a task.
+        """
+        chunk = self.replay.take_chunk()
+        if chunk is not None:
+            pipe = get_async_redis().pipeline()
+            pipe.rpush(replay_key(self.game_id), chunk)
+            pipe.expire(replay_key(self.game_id), settings.PONG_GAME_TTL)
+            await pipe.execute()
+        if archive and self.replay.ticks:
+            from server_side_pong.tasks import archive_replay
+            await sync_to_async(archive_replay.delay)(self.game_id)
+
+    async def load_match(self):
+        """Cache what the loop needs from the Game row, so rounds never touch the database."""
+        self.match = await GameManager.aget_match(self.game_id)
 
     async def end_of_round(self):
-        await self.stop_game_loop()
-        game = await sync_to_async(self.Game.objects.get)(id=self.game_id)
-        player1score = self.game_state["scores"]["player1"]
-        player2score = self.game_state["scores"]["player2"]
-        if self.game_state["scores"]["player1"] == game.rounds_needed:
-            logger.info(f"Right before end_of_game with game.rounds_needed being {game.rounds_needed} and player1 score being {player1score} ")
+        await self.save_replay()
+        if self.match is None:
+            await self.load_match()
+        rounds_needed = self.match.rounds_needed
+        player1score = self.game_state.score1
+        player2score = self.game_state.score2
+        if player1score == rounds_needed:
+            logger.info(f"Right before end_of_game with game.rounds_needed being {rounds_needed} and player1 score being {player1score} ")
+            await self.stop_game_loop()
             await self.end_of_game("player1")
-        elif self.game_state["scores"]["player2"] == game.rounds_needed:
-            logger.info(f"Right before end_of_game with game.rounds_needed being {game.rounds_needed} and player1 score being {player2score} ")
+        elif player2score == rounds_needed:
+            logger.info(f"Right before end_of_game with game.rounds_needed being {rounds_needed} and player1 score being {player2score} ")
+            await self.stop_game_loop()
             await self.end_of_game("player2")
         else:
-            await self.reset_ball()
-            await self.start_game_loop()
+            self.next_round()
 
     async def end_of_game(self, winner):
+        """
+        Save the result, then announce it. This runs in a task of its own (see
+        PongEngine.end_round): the engine keeps ticking while the persistence queue writes
+        the result in the background, and the players never see a result the database
+        does not have.
+        """
         try:
-            # Retrieve the game state from the GameManager
-            game_state = GameManager.get_game_state(self.game_id)
-            if not game_state:
-                logger.error(f"Game state not found for game_id {self.game_id}")
-                return
-
-            # Determine the winner's user_id from the game state
-            winner_user_id = game_state["players"].get(winner, {}).get("user_id")
-            if not winner_user_id:
+            # Player ids are the user ids, the game state knows them too
+            winner_id = self.match.player_id(winner) or self.game_state.paddle(winner).user_id
+            if not winner_id:
                 logger.error(f"Winner user_id not found in game state for game_id {self.game_id} and winner {winner}")
                 return
-            logger.info(f"Winner user_id retrieved from game state: {winner_user_id}")
+            logger.info(f"Game {self.game_id} winner is: {winner_id}")
 
-            # Fetch the Player model using the winner's user_id, with related fields preloaded
-            try:
-                winning_player = await sync_to_async(
-                    self.Player.objects.select_related("user").get
-                )(id=winner_user_id)
-                logger.info(f"Winning player fetched with ID: {winning_player.id}")
-            except self.Player.DoesNotExist:
-                logger.error(f"Player with id {winner_user_id} does not exist")
-                return
+            # last points, then the winner: the consumers must not count a disconnection
+            # after this point as a forfeit
+            await self.flush()
+            await GameManager.afinish_game(self.game_id, winner_id)
+            await self.save_replay(archive=True)
 
-            # Fetch the game object
-            try:
-                game = await sync_to_async(self.Game.objects.get)(id=self.game_id)
-            except self.Game.DoesNotExist:
-                logger.error(f"Game with id {self.game_id} does not exist")
-                return
-
-            # Assign the winning player to the game.winner field
-            game.winner = winning_player
-            logger.info(f"Game {self.game_id} winner is being set to: {winning_player.id}")
-
-            # Save the game object
-            await sync_to_async(game.save)()
-            logger.info(f"Game {self.game_id} saved with winner: {winning_player.id}")
+            # winner, end time and status completed are saved by the persistence queue
+            if not await GameManager.persistence.submit(MatchResult(self.game_id, winner_id, timezone.now())):
+                logger.error(f"The result of game {self.game_id} was not saved, it is announced anyway")
 
-            score = game_state["scores"]
+            score = self.game_state.scores
             # Broadcast the game state as finished
             logger.info(f"Game {self.game_id} score is : {score}")
-            channel_layer = get_channel_layer()
-            await channel_layer.group_send(
-                f"game_{self.game_id}",
-                {
-                    "type": "broadcast_game_state",
-                    "state": {"type": "ending", "state": "finished", "score": score, "winnerId": winning_player.id},
-                },
-            )
-
-            # Update game status and end time
-            game.end_time = timezone.now()
-            game.status = "completed"
-            await sync_to_async(game.save)()
-            logger.info(f"Game {self.game_id} status updated to completed.")
+            await GameManager.abroadcast_state(self.game_id, {"type": "ending", "state": "finished", "score": score, "winnerId": winner_id})
 
         except Exception as e:
             logger.error(f"An unexpected error occurred in end_of_game: {e}")
 
 
-    async def reset_ball(self):
-        self.game_state["ball"] = {
-            "x": SCREEN_WIDTH / 2,
-            "y": SCREEN_HEIGHT / 2,
-            "vx": BALL_SPEED * (-VXSPEED if random.random() < 0.5 else VXSPEED),
-            "vy": BALL_SPEED * (-VYSPEED if random.random() < 0.5 else VYSPEED),
-        }
-        GameManager.save_game_state(self.game_id, self.game_state)
+class GameplayProtocolMixin:
+    """Sends the gameplay frames in the format negotiated by the client (binary deltas or JSON)."""
+    binary = False
+    encoder = "encoder"  # attribute of TwoPlayerPong encoding the frames this consumer receives
 
-    async def get_state(self):
-        return self.game_state
+    async def accept_protocol(self):
+        """Accept the connection, in binary mode if the client offered BINARY_SUBPROTOCOL."""
+        if BINARY_SUBPROTOCOL in self.scope.get("subprotocols", []):
+            self.binary = True
+            await self.accept(BINARY_SUBPROTOCOL)
+            # a delta is useless without the frame it applies to
+            if self.game_id in GameManager._instances:
+                getattr(GameManager._instances[self.game_id], self.encoder).request_keyframe()
+        else:
+            await self.accept()
+
+    async def broadcast_game_state(self, event):
+        """Forward a frame encoded by the game loop, only one-off messages come as a "state" dict."""
+        if self.binary and "frame" in event:
+            await self.send(bytes_data=event["frame"])
+        elif "text" in event:
+            await self.send(text_data=event["text"])
+        else:
+            await self.send(text_data=json.dumps(event["state"]))
 
 
-class RemotePongConsumer(AsyncWebsocketConsumer):
+class RemotePongConsumer(GameplayProtocolMixin, AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         app_config = apps.get_app_config('server_side_pong')
@@ -405,18 +717,18 @@ class RemotePongConsumer(AsyncWebsocketConsumer):
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         logger.info(f"User connected: {self.scope['user'].username}, user_id: {self.user_id}")
 
-        if not GameManager.game_exists(self.game_id):
+        if not await GameManager.agame_exists(self.game_id):
             logger.warning(f"Game with ID {self.game_id} does not exist.")
             await self.close(code=4003)
             return
 
-        await self.accept()
+        await self.accept_protocol()
 
         try:
-            if GameManager.is_user_in_game(self.game_id, self.user_id):
+            if await GameManager.ais_user_in_game(self.game_id, self.user_id):
                 logger.info(f"User {self.user_id} is reconnecting to game {self.game_id}")
             else:
-                self.role = GameManager.add_player(self.game_id, self.user_id)
+                self.role = await GameManager.aadd_player(self.game_id, self.user_id)
             try:
                 logger.info(f" self.role is {self.role}")
             except Exception as e:
@@ -424,22 +736,17 @@ class RemotePongConsumer(AsyncWebsocketConsumer):
             await self._assign_role_and_initialize_game()
 
             if self.role == "player2":
-                game_state = GameManager.get_game_state(self.game_id)
-                player1_user_id = game_state["players"]["player1"]["user_id"]
-                player1 = await sync_to_async(self.Player.objects.get)(user__id=player1_user_id)
-                player2 = await sync_to_async(self.Player.objects.get)(user__id=self.user_id)
-                game = await self.Game.objects.aget(id=self.game_id)
-                is_tournament = game.tournament_id is not None
-                logger.info(f"Is it a tournament ? {is_tournament}")
+                match = await GameManager.aget_match(self.game_id)
+                logger.info(f"Is it a tournament ? {match.is_tournament}")
                 channel_layer = get_channel_layer()
                 await channel_layer.group_send(
                     self.group_name,
                     {
                         "type": "broadcast_init",
-                        "message": {"type": "init", "player1" : player1.nickname, "player2": player2.nickname, "tournament": is_tournament},
+                        "message": {"type": "init", "player1" : match.player1_nickname, "player2": match.player2_nickname, "tournament": match.is_tournament},
                     }
                 )
-                GameManager.start_game(self.game_id)
+                await GameManager.start_game(self.game_id)
 
         except ValueError as e:
             logger.error(f"Error during connection: {e}")
@@ -494,52 +801,37 @@ class RemotePongConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error logging game.status: {e}")
 
     async def disconnect(self, close_code):
-        game = await sync_to_async(self.Game.objects.get)(id=self.game_id)
+        game = await self.Game.objects.select_related("player1", "player2").aget(id=self.game_id)
+        if game.status != "completed" and await GameManager.agame_winner(self.game_id) is not None:
+            # ended by the game loop, the result is on its way to the database
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            return
+        match = MatchDescriptor.from_game(game)
         if game.status == "ongoing":
-            game_state = GameManager.get_game_state(self.game_id)
-            if not game_state:
-                logger.error(f"Game state not found for game_id {self.game_id}")
-                return
-            player1_id = game_state["players"]["player1"].get("user_id")
-            player2_id = game_state["players"]["player2"].get("user_id")
-            winner_id = player1_id if self.user_id != player1_id else player2_id
-            try:
-                winning_player = await sync_to_async(
-                    self.Player.objects.select_related("user").get
-                )(id=winner_id)
-                logger.info(f"Winning player fetched with ID: {winning_player.id}")
-            except self.Player.DoesNotExist:
-                logger.error(f"Player with id {winner_id} does not exist")
+            loser = match.role_of(self.user_id)
+            if loser is None:
+                logger.error(f"User {self.user_id} is not a player of game {self.game_id}")
                 return
-            try:
-                loosing_player = await sync_to_async(
-                    self.Player.objects.select_related("user").get
-                )(id=self.user_id)
-                logger.info(f"Loosing player fetched with ID: {self.user_id}")
-            except self.Player.DoesNotExist:
-                logger.error(f"Player with id {self.user_id} does not exist")
+            winner = match.opponent(loser)
+            if match.player_id(winner) is None:
+                logger.error(f"Game {self.game_id} has no {winner} to win it")
                 return
-            game.winner = winning_player
-            logger.info(f"Game {self.game_id} winner is being set to:{winning_player.nickname} {winning_player.id} due to disconnection of opponent player with id {loosing_player.nickname} {self.user_id}")
+            game.winner_id = match.player_id(winner)
+            logger.info(f"Game {self.game_id} winner is being set to:{match.nickname(winner)} {game.winner_id} due to disconnection of opponent player with id {match.nickname(loser)} {self.user_id}")
             game.end_time = timezone.now()
             game.status = "completed"
-            channel_layer = get_channel_layer()
-            await channel_layer.group_send(
-                f"game_{self.game_id}",
-                {
-                    "type": "broadcast_game_state",
-                    "state": {"type": "disconnection", "disconnected": loosing_player.nickname, "winner": winning_player.nickname},
-                },
-            )
+            await GameManager.abroadcast_state(self.game_id, {"type": "disconnection", "disconnected": match.nickname(loser), "winner": match.nickname(winner)})
             await sync_to_async(game.save)()
-            GameManager.stop_game(self.game_id)
+            await GameManager.stop_game(self.game_id)
         elif game.status == "waiting":
-            disconnector = await sync_to_async(self.Player.objects.select_related("user").get)(id=self.user_id)
-            logger.info(f"Game {self.game_id} got killed because of premature disconnection of player {disconnector.nickname} with id{self.user_id}")
+            role = match.role_of(self.user_id)
+            # a user not seated yet has no nickname in the game
+            nickname = match.nickname(role) if role is not None else self.user_id
+            logger.info(f"Game {self.game_id} got killed because of premature disconnection of player {nickname} with id{self.user_id}")
             game.end_time = timezone.now()
             game.status = "interrupted"
             await sync_to_async(game.save)()
-            GameManager.stop_game(self.game_id)
+            await GameManager.stop_game(self.game_id)
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
     async def receive(self, text_data):
@@ -549,20 +841,16 @@ class RemotePongConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error processing received message: {e}")
 
         try:
-            game_instance = GameManager.get_game_instance(self.game_id)
-            await game_instance.remote_update_state(self.role, data)
+            await GameManager.handle_input(self.game_id, self.role, data)
         except ValueError as e:
             await self.send(text_data=json.dumps({"error": str(e)}))
 
-    async def broadcast_game_state(self, event):
-        await self.send(text_data=json.dumps(event["state"]))
-
     async def broadcast_init(self, event):
         await self.send(text_data=json.dumps(event["message"]))
 
 ###################LOCALLOCALLOCALLOCALLOCALLOCAL###############################################################
 
-class LocalPongConsumer(AsyncWebsocketConsumer):
+class LocalPongConsumer(GameplayProtocolMixin, AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         app_config = apps.get_app_config('server_side_pong')
@@ -583,22 +871,22 @@ class LocalPongConsumer(AsyncWebsocketConsumer):
         self.group_name = f"game_{self.game_id}"
         await self.channel_layer.group_add(self.group_name, self.channel_name)
 
-        if not GameManager.game_exists(self.game_id):
+        if not await GameManager.agame_exists(self.game_id):
             logger.warning(f"Game with ID {self.game_id} does not exist")
             await self.close(code=4003)
             return
 
-        await self.accept()
+        await self.accept_protocol()
 
         try:
-            if GameManager.is_user_in_game(self.game_id, self.user_id):
+            if await GameManager.ais_user_in_game(self.game_id, self.user_id):
                 logger.info(f"User {self.user_id} is reconnecting to game {self.game_id}")
             else:
-                self.role = GameManager.add_player(self.game_id, self.user_id)
+                self.role = await GameManager.aadd_player(self.game_id, self.user_id)
                 await self._assign_role_and_initialize_game()
-            player = await sync_to_async(self.Player.objects.get)(user__id=self.user_id)
-            await self.send(text_data=json.dumps({"type": "init", "player1" : player.nickname, "player2": "Guest"}))
-            GameManager.start_game(self.game_id)
+            match = await GameManager.aget_match(self.game_id)
+            await self.send(text_data=json.dumps({"type": "init", "player1" : match.player1_nickname, "player2": "Guest"}))
+            await GameManager.start_game(self.game_id)
 
         except ValueError as e:
             logger.error(f"Error during connection: {e}")
@@ -614,7 +902,7 @@ class LocalPongConsumer(AsyncWebsocketConsumer):
 
         if self.role == "player1":
             guest_player = await sync_to_async(get_or_create_guest_player)()
-            GameManager.add_player(self.game_id, await sync_to_async(lambda: guest_player.user.id)())
+            await GameManager.aadd_player(self.game_id, await sync_to_async(lambda: guest_player.user.id)())
             game_model.player1 = player
             game_model.player2 = guest_player
             game_model.status = "ongoing"
@@ -627,55 +915,74 @@ class LocalPongConsumer(AsyncWebsocketConsumer):
         }))
 
     async def disconnect(self, close_code):
-        game = await sync_to_async(self.Game.objects.get)(id=self.game_id)
+        game = await self.Game.objects.select_related("player1", "player2").aget(id=self.game_id)
+        if game.status != "completed" and await GameManager.agame_winner(self.game_id) is not None:
+            # ended by the game loop, the result is on its way to the database
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            return
+        match = MatchDescriptor.from_game(game)
         if game.status != "completed":
-            game_state = GameManager.get_game_state(self.game_id)
-            if not game_state:
-                logger.error(f"Game state not found for game_id {self.game_id}")
-                return
-            player1_id = game_state["players"]["player1"].get("user_id")
-            player2_id = game_state["players"]["player2"].get("user_id")
-            winner_id = player1_id if self.user_id != player1_id else player2_id
-            try:
-                winning_player = await sync_to_async(
-                    self.Player.objects.select_related("user").get
-                )(id=winner_id)
-                logger.info(f"Winning player fetched with ID: {winning_player.id}")
-            except self.Player.DoesNotExist:
-                logger.error(f"Player with id {winner_id} does not exist")
+            loser = match.role_of(self.user_id)
+            if loser is None:
+                logger.error(f"User {self.user_id} is not a player of game {self.game_id}")
                 return
-            try:
-                loosing_player = await sync_to_async(
-                    self.Player.objects.select_related("user").get
-                )(id=self.user_id)
-                logger.info(f"Loosing player fetched with ID: {self.user_id}")
-            except self.Player.DoesNotExist:
-                logger.error(f"Player with id {self.user_id} does not exist")
+            winner = match.opponent(loser)
+            if match.player_id(winner) is None:
+                logger.error(f"Game {self.game_id} has no {winner} to win it")
                 return
-            game.winner = winning_player
-            logger.info(f"Game {self.game_id} winner is being set to:{winning_player.nickname} {winning_player.id} due to disconnection of opponent player with id {loosing_player.nickname} {self.user_id}")
+            game.winner_id = match.player_id(winner)
+            logger.info(f"Game {self.game_id} winner is being set to:{match.nickname(winner)} {game.winner_id} due to disconnection of opponent player with id {match.nickname(loser)} {self.user_id}")
             game.end_time = timezone.now()
             game.status = "completed"
-            channel_layer = get_channel_layer()
-            await channel_layer.group_send(
-                f"game_{self.game_id}",
-                {
-                    "type": "broadcast_game_state",
-                    "state": {"type": "disconnection", "disconnected": loosing_player.nickname, "winner": winning_player.nickname},
-                },
-            )
+            await GameManager.abroadcast_state(self.game_id, {"type": "disconnection", "disconnected": match.nickname(loser), "winner": match.nickname(winner)})
             await sync_to_async(game.save)()
-            GameManager.stop_game(self.game_id)
+            await GameManager.stop_game(self.game_id)
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
     async def receive(self, text_data):
         data = json.loads(text_data)
 
         try:
-            game_instance = GameManager.get_game_instance(self.game_id)
-            await game_instance.local_update_state(self.role, data)
+            await GameManager.handle_input(self.game_id, self.role, data, local=True)
         except ValueError as e:
             await self.send(text_data=json.dumps({"error": str(e)}))
+###################SPECTATORSPECTATORSPECTATOR###############################################################
 
-    async def broadcast_game_state(self, event):
-        await self.send(text_data=json.dumps(event["state"]))
\ No newline at end of file
+class SpectatorPongConsumer(GameplayProtocolMixin, AsyncWebsocketConsumer):
+    """
+    Read only view of a game. Spectators are never seated (no GameManager.add_player) and
+    listen to the spectator group of the game, which the engine feeds at PONG_SPECTATOR_RATE
+    frames per second, apart from the group of the players.
+    """
+    encoder = "spectator_encoder"
+
+    async def connect(self):
+        self.game_id = self.scope['url_route']['kwargs']['game_id']
+        self.group_name = GameManager.spectator_group(self.game_id)
+
+        if not self.scope['user'].is_authenticated:
+            await self.close(code=4003)  # Unauthorized
+            return
+
+        if not await GameManager.agame_exists(self.game_id):
+            logger.warning(f"Game with ID {self.game_id} does not exist, nothing to spectate.")
+            await self.close(code=4003)
+            return
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept_protocol()
+        match = await GameManager.aget_match(self.game_id)
+        await self.send(text_data=json.dumps({
+            "type": "init",
+            "player1": match.player1_nickname,
+            "player2": match.player2_nickname,
+            "tournament": match.is_tournament,
+            "spectator": True,
+        }))
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # spectators have no say in the game
+        pass
@@ -0,0 +1,186 @@
+import asyncio, logging, time
+from channels.layers import get_channel_layer
+from .scheduler import FixedTimestepScheduler
+from .physics import PythonPhysics
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ticks between two frames sent to the players, from the normal rate to the most degraded
+# one: 60, 30 and 20 Hz at 60 ticks per second. Physics keeps its fixed step whatever the level.
+BROADCAST_INTERVALS = (1, 2, 3)
+LOAD_SMOOTHING = 0.05 # weight of the last tick in the moving average of the tick duration
+RECOVERY_RATIO = 0.5 # the rate goes back up once the average is under this share of the budget
+
+
+def spawn(tasks, coro, description):
+    """Run coro in the background, keeping its task in `tasks` until it is done and logging its failure."""
+    task = asyncio.create_task(coro)
+    tasks.add(task)
+
+    def done(task):
+        tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"{description} failed", exc_info=task.exception())
+
+    task.add_done_callback(done)
+    return task
+
+
+class PongEngine:
+    """
+    One tick loop per process advancing every running game together.
+
+    Games are registered with add() and advanced in a single batched tick; the frames
+    of all games are then broadcast concurrently. The loop only runs while at least
+    one game is registered, so an idle worker does not wake up 60 times per second.
+    The simulation itself is delegated to a physics backend (see physics.get_physics_backend).
+    When a store is set (GameManager), games for which Redis is authoritative are reloaded
+    before the tick and the Redis writes scheduled during the tick are flushed after it,
+    each in one pipelined round trip for all games.
+    Spectators are sent a frame every spectator_interval ticks only, to a group of their
+    own, so the size of the audience does not delay the frames of the players.
+    When the average tick takes more than tick_budget of the step, frames are sent to the
+    players less often (see BROADCAST_INTERVALS) until the load goes down; tournament games
+    stay one level behind the others. A game still gets a frame at once when it applied
+    inputs or scored, and every frame tells the clients when to expect the next one.
+    """
+
+    def __init__(self, tick_rate=60, max_catchup=5, physics=None, store=None, spectator_rate=20, tick_budget=0.8):
+        self.tick_rate = tick_rate
+        self.spectator_interval = max(1, round(tick_rate / spectator_rate))
+        self.ticks = 0
+        self.budget = tick_budget / tick_rate
+        self.load = 0.0  # moving average of the tick duration, in seconds
+        self.level = 0  # index in BROADCAST_INTERVALS
+        self.level_changed = 0  # tick of the last change of level
+        self.max_catchup = max_catchup
+        self.physics = physics if physics is not None else PythonPhysics()
+        self.store = store
+        self.games = {}  # game_id -> TwoPlayerPong
+        self.stats = metrics.TICK_STATS  # exported by metrics_view
+        self.channel_layer = None
+        self.task = None
+        self.round_tasks = set()  # end_round tasks in progress
+        self.received = []  # queue times of the inputs applied in the current tick, reused
+
+    def add(self, game):
+        if game.game_id in self.games:
+            return
+        game.start()
+        self.games[game.game_id] = game
+        metrics.ACTIVE_GAMES.set(len(self.games))
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def remove(self, game_id):
+        self.games.pop(game_id, None)
+        self.physics.release(game_id)
+        metrics.ACTIVE_GAMES.set(len(self.games))
+
+    async def run(self):
+        self.channel_layer = get_channel_layer()
+        scheduler = FixedTimestepScheduler(self.tick_rate, self.max_catchup, self.stats)
+        logger.info("Pong engine is starting")
+        try:
+            while self.games:
+                # number of fixed steps needed to catch up with wall time
+                steps = await scheduler.wait()
+                try:
+                    await self.tick(steps, scheduler)
+                except Exception:
+                    logger.exception("Pong engine tick failed")
+
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.task = None
+            logger.info(f"Pong engine stopped, tick stats: {self.stats}")
+
+    async def tick(self, steps, scheduler):
+        started = time.perf_counter()
+        redis_commands = metrics.REDIS_COMMANDS.value
+        metrics.TICKS.inc()
+        active = []
+        for game_id, game in list(self.games.items()):
+            if not game.running:
+                self.remove(game_id)
+                logger.info(f"Game {game_id} left the engine")
+            elif not game.paused:
+                active.append(game)
+
+        if self.store is not None:
+            await self.store.arefresh_games(active)
+        received = self.received
+        received.clear()
+        urgent = set()
+        for game in active:
+            if game.drain_inputs(received):
+                urgent.add(game.game_id)
+
+        self.ticks += 1
+        spectated = self.ticks % self.spectator_interval == 0
+        frames = []
+        for game, scorer in self.physics.advance(active, steps, scheduler.step):
+            game.record_tick()
+            interval = self.broadcast_interval(game)
+            game.since_broadcast += 1
+            if game.since_broadcast >= interval or scorer or game.game_id in urgent:
+                game.since_broadcast = 0
+                frames.append(game.frame(round(interval * 1000 / self.tick_rate)))
+            if spectated:
+                frames.append(game.spectator_frame(round(self.spectator_interval * 1000 / self.tick_rate)))
+            if scorer:
+                # the round is settled off the tick so one game's database access never delays the others
+                game.paused = True
+                spawn(self.round_tasks, self.end_round(game), f"End of round of game {game.game_id}")
+
+        # Broadcast the frames of every game at once, while Redis gets the checkpoints
+        pending = [self.broadcast(frames, received)]
+        if self.store is not None:
+            pending.append(self.store.aflush_games(active))
+        await asyncio.gather(*pending)
+
+        duration = time.perf_counter() - started
+        metrics.TICK_DURATION.observe(duration)
+        metrics.REDIS_COMMANDS_PER_TICK.observe(metrics.REDIS_COMMANDS.value - redis_commands)
+        self.adapt(duration)
+
+    def broadcast_interval(self, game):
+        """Ticks between two frames of `game` at the current load level."""
+        level = self.level - 1 if game.priority and self.level > 0 else self.level
+        return BROADCAST_INTERVALS[level]
+
+    def adapt(self, duration):
+        """Move one broadcast level down or up, at most once per second, as the average tick duration crosses the budget."""
+        self.load += (duration - self.load) * LOAD_SMOOTHING
+        if self.ticks - self.level_changed < self.tick_rate:
+            return
+        if self.load > self.budget and self.level < len(BROADCAST_INTERVALS) - 1:
+            self.level += 1
+        elif self.load < self.budget * RECOVERY_RATIO and self.level > 0:
+            self.level -= 1
+        else:
+            return
+        self.level_changed = self.ticks
+        metrics.BROADCAST_INTERVAL.set(BROADCAST_INTERVALS[self.level])
+        logger.warning(f"Pong engine average tick is {self.load * 1000:.2f} ms, frames now sent every {BROADCAST_INTERVALS[self.level]} ticks")
+
+    async def broadcast(self, frames, received):
+        """Send the frames of the tick, and time them along with the inputs they carry."""
+        if not frames:
+            return
+        started = time.perf_counter()
+        await asyncio.gather(*(self.channel_layer.group_send(group, message) for group, message in frames))
+        sent = time.perf_counter()
+        metrics.BROADCAST_DURATION.observe(sent - started)
+        for received_at in received:
+            metrics.INPUT_TO_BROADCAST.observe(sent - received_at)
+
+    async def end_round(self, game):
+        try:
+            await game.end_of_round()
+        except Exception as e:
+            logger.error(f"Error ending round of game {game.game_id}: {e}")
+            game.running = False
+        game.paused = False
@@ -0,0 +1,102 @@
+from bisect import bisect_left
+from .scheduler import TickStats
+
+# Metrics of the pong engine of this process, in the Prometheus text format (see metrics_view).
+# Every metric object is created once at import; recording a value is an attribute update,
+# so the instrumentation stays on in production without logging anything per tick.
+
+
+class Counter:
+    """A value going up, or read from `function` at scrape time."""
+    __slots__ = ("name", "help", "value", "function")
+    kind = "counter"
+
+    def __init__(self, name, help, function=None):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.function = function
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, "", self.function() if self.function is not None else self.value
+
+
+class Gauge(Counter):
+    """A value going up and down, or read from `function` at scrape time."""
+    __slots__ = ()
+    kind = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    __slots__ = ("name", "help", "buckets", "counts", "sum", "count")
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{self.name}_bucket", f'{{le="{bound}"}}', cumulative
+        yield f"{self.name}_bucket", '{le="+Inf"}', self.count
+        yield f"{self.name}_sum", "", self.sum
+        yield f"{self.name}_count", "", self.count
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.0166, 0.025, 0.05, 0.1, 0.25)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+# filled by the scheduler of the engine (PongEngine.run), read at scrape time
+TICK_STATS = TickStats()
+
+TICK_DURATION = Histogram("pong_tick_duration_seconds", "Time spent in one engine tick, Redis and broadcast included.", LATENCY_BUCKETS)
+REDIS_COMMANDS_PER_TICK = Histogram("pong_redis_commands_per_tick", "Redis commands sent by the engine in one tick.", COUNT_BUCKETS)
+REDIS_COMMANDS = Counter("pong_redis_commands_total", "Redis commands sent by the engine.")
+BROADCAST_DURATION = Histogram("pong_broadcast_duration_seconds", "Time to fan out the frames of one tick to the channel layer.", LATENCY_BUCKETS)
+INPUT_TO_BROADCAST = Histogram("pong_input_to_broadcast_seconds", "Time from an input reaching the game to the broadcast of the frame applying it.", LATENCY_BUCKETS)
+TICKS = Counter("pong_ticks_total", "Engine ticks.")
+FRAMES_DROPPED = Counter("pong_frames_dropped_total", "Fixed steps dropped because the engine fell too far behind.", lambda: TICK_STATS.skipped)
+OVERRUNS = Counter("pong_tick_overruns_total", "Engine ticks whose deadline had passed when the loop came back to wait.", lambda: TICK_STATS.overruns)
+JITTER_MAX = Gauge("pong_tick_jitter_max_seconds", "Longest wake-up lateness of the engine loop.", lambda: TICK_STATS.jitter_max)
+JITTER_AVG = Gauge(
+    "pong_tick_jitter_avg_seconds", "Average wake-up lateness of the engine loop.",
+    lambda: TICK_STATS.jitter_total / TICK_STATS.frames if TICK_STATS.frames else 0.0,
+)
+INPUTS_DROPPED = Counter("pong_inputs_dropped_total", "Player inputs dropped: queue full or game not running anywhere.")
+ACTIVE_GAMES = Gauge("pong_active_games", "Games advanced by the engine of this worker.")
+BROADCAST_INTERVAL = Gauge("pong_broadcast_interval_ticks", "Ticks between two frames sent to the players of non tournament games.")
+BROADCAST_INTERVAL.set(1)
+
+REGISTRY = [
+    TICK_DURATION, REDIS_COMMANDS_PER_TICK, REDIS_COMMANDS, BROADCAST_DURATION,
+    INPUT_TO_BROADCAST, TICKS, FRAMES_DROPPED, OVERRUNS, JITTER_MAX, JITTER_AVG, INPUTS_DROPPED,
+    ACTIVE_GAMES, BROADCAST_INTERVAL,
+]
+
+
+def render(registry=REGISTRY):
+    """Every metric of the registry in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
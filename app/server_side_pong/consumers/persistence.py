@@ -0,0 +1,99 @@
+import asyncio, logging
+from typing import NamedTuple
+from datetime import datetime
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_save
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 50
+RESULT_FIELDS = ["winner", "end_time", "status"]
+
+
+class MatchResult(NamedTuple):
+    game_id: int
+    winner_id: int  # Player id, the same as the user id
+    end_time: datetime
+
+
+def write_results(results):
+    """
+    Save a batch of results: one query to load the games, one UPDATE for all of them.
+
+    bulk_update does not send post_save, so it is sent for each game once the transaction
+    is committed: the statistics and tournament receivers see the finished games exactly
+    as if game.save() had been called.
+    """
+    Game = apps.get_model("server_side_pong", "Game")
+    with transaction.atomic():
+        games = Game.objects.in_bulk([result.game_id for result in results])
+        updated = []
+        for result in results:
+            game = games.get(result.game_id)
+            if game is None:
+                logger.error(f"Game with id {result.game_id} does not exist, its result is lost")
+                continue
+            game.winner_id = result.winner_id
+            game.end_time = result.end_time
+            game.status = "completed"
+            updated.append(game)
+        Game.objects.bulk_update(updated, RESULT_FIELDS)
+
+    for game in updated:
+        post_save.send(sender=Game, instance=game, created=False, update_fields=frozenset(RESULT_FIELDS), raw=False, using=game._state.db)
+    logger.info(f"Saved the results of games {[game.id for game in updated]}")
+    return updated
+
+
+class PersistenceQueue:
+    """
+    Match results waiting to be written to the database.
+
+    submit() never waits; a background task of the same event loop writes whatever
+    accumulated in one batch per database round trip, so a burst of games ending together
+    costs a single transaction. The future submit() returns is resolved once the batch of
+    the result is committed (True) or failed (False), so the caller can hold back what
+    must not get ahead of the database.
+    """
+
+    def __init__(self, max_batch=MAX_BATCH, writer=write_results):
+        self.max_batch = max_batch
+        self.writer = writer
+        self.queue = None
+        self.task = None
+        self.loop = None
+
+    def submit(self, result):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.loop is not loop:
+            self.loop = loop
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self.run())
+        done = loop.create_future()
+        self.queue.put_nowait((result, done))
+        return done
+
+    async def run(self):
+        queue = self.queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            results = [result for result, _ in batch]
+            try:
+                await sync_to_async(self.writer)(results)
+                saved = True
+            except Exception:
+                logger.exception(f"Failed to save the results of games {[result.game_id for result in results]}")
+                saved = False
+            for _, done in batch:
+                if not done.done():
+                    done.set_result(saved)
+                queue.task_done()
+
+    async def join(self):
+        """Wait until every submitted result has been written."""
+        if self.queue is not None:
+            await self.queue.join()
@@ -0,0 +1,103 @@
+from django.core.exceptions import ImproperlyConfigured
+from .utils import adjust_ball_velocity
+
+PADDLE_SPEED = 3
+BALL_SPEED = 1.05
+BALL_RADIUS = 1.5
+SCREEN_WIDTH = 160
+SCREEN_HEIGHT = 90
+PADDLE_HEIGHT = 15
+EPSILON = 1e-2
+BALL_SPEED_STEP = 1.05
+VXSPEED = 1
+VYSPEED = 0.9
+
+
+def slide_direction(movement):
+    """-1 when the paddle goes up, 1 when it goes down, 0 when it stays still."""
+    if movement == "w" or movement == "ArrowUp":
+        return -1
+    if movement == "s" or movement == "ArrowDown":
+        return 1
+    return 0
+
+
+def move_paddles(game_state):
+    for paddle in (game_state.player1, game_state.player2):
+        if paddle.slide < 0:
+            paddle.y = max(paddle.y - PADDLE_SPEED, 0)
+        elif paddle.slide > 0:
+            paddle.y = min(paddle.y + PADDLE_SPEED, SCREEN_HEIGHT - PADDLE_HEIGHT)
+
+
+def step_ball(game_state):
+    """Move the ball one step. Returns the role that scored, if any (scores are left untouched)."""
+    ball = game_state.ball
+
+    # Predict the next position of the ball
+    next_x = ball.x + ball.vx
+    next_y = ball.y + ball.vy
+
+    # Handle wall collisions (top/bottom)
+    if next_y <= 0 or next_y >= SCREEN_HEIGHT:
+        ball.vy = -ball.vy
+        next_y = ball.y + ball.vy  # Update predicted position after collision
+
+    player1 = game_state.player1
+    player2 = game_state.player2
+
+    #The collision logic works for "grazing" cases because it checks whether the path of the ball intersects with the paddle's boundary,
+    # rather than relying solely on the ball's exact position (next_x or next_y) during a single frame.
+    # For player1's paddle
+    if (
+        ball.vx < 0 and # Ball is moving towards player1's paddle
+        next_x - BALL_RADIUS <= player1.x <= ball.x + BALL_RADIUS and # Ball's path intersects the paddle's vertical plane
+        player1.y <= next_y <= player1.y + PADDLE_HEIGHT # Ball's vertical position is within the paddle's range
+    ):
+        ball.vx = -ball.vx
+        adjust_ball_velocity(ball, player1.y, PADDLE_HEIGHT, BALL_SPEED_STEP)
+        if next_x - BALL_RADIUS < player1.x:
+            next_x = player1.x + BALL_RADIUS
+
+    # For player2's paddle
+    if (
+        ball.vx > 0 and # Ball is moving towards player2's paddle
+        ball.x - BALL_RADIUS <= player2.x <= next_x + BALL_RADIUS and # Ball's path intersects the paddle's vertical plane
+        player2.y <= next_y <= player2.y + PADDLE_HEIGHT # Ball's vertical position is within the paddle's range
+    ):
+        ball.vx = -ball.vx
+        adjust_ball_velocity(ball, player2.y, PADDLE_HEIGHT, BALL_SPEED_STEP)
+        if next_x + BALL_RADIUS > player2.x:
+            next_x = player2.x - BALL_RADIUS
+
+    # Update the ball's position after all collision checks
+    ball.x = next_x
+    ball.y = next_y
+
+    if ball.x <= 0 + EPSILON:
+        return "player2"
+    elif ball.x >= SCREEN_WIDTH - EPSILON:
+        return "player1"
+    return None
+
+
+class PythonPhysics:
+    """Default backend: every game is advanced one by one on its own GameState."""
+
+    def advance(self, games, steps, step):
+        """Advance `games` by `steps` fixed steps. Returns a list of (game, scorer)."""
+        return [(game, game.advance(steps, step)) for game in games]
+
+    def release(self, game_id):
+        pass
+
+
+def get_physics_backend(name, in_memory):
+    if name == "python":
+        return PythonPhysics()
+    if name == "numpy":
+        if not in_memory:
+            raise ImproperlyConfigured("The numpy physics backend needs PONG_IN_MEMORY_STATE.")
+        from .physics_numpy import NumpyPhysics
+        return NumpyPhysics()
+    raise ImproperlyConfigured(f"Unknown PONG_PHYSICS_BACKEND '{name}', must be 'python' or 'numpy'.")
@@ -0,0 +1,173 @@
+import numpy as np
+from .physics import (
+    PADDLE_SPEED, BALL_RADIUS, SCREEN_WIDTH, SCREEN_HEIGHT, PADDLE_HEIGHT,
+    EPSILON, BALL_SPEED_STEP,
+)
+
+# Columns of NumpyPhysics.bodies
+BX, BY, VX, VY, P1X, P1Y, P2X, P2Y = range(8)
+
+# Values of the array returned by NumpyPhysics.step
+NO_POINT, PLAYER1_POINT, PLAYER2_POINT = 0, 1, 2
+SCORERS = {PLAYER1_POINT: "player1", PLAYER2_POINT: "player2"}
+
+
+class NumpyPhysics:
+    """
+    Batched backend: the ball and paddles of every game live in one contiguous array
+    (one row per game) and all games are advanced with vectorized operations.
+
+    It mirrors physics.move_paddles / physics.step_ball operation for operation, so both
+    backends produce the same floats. The arrays are authoritative while a game is
+    attached; the GameState objects are refreshed after each frame for broadcasts and
+    checkpoints, and reloaded into the array whenever the game sets `resync` (start of
+    game, new serve).
+    """
+
+    def __init__(self, capacity=64):
+        self.bodies = np.zeros((capacity, 8), dtype=np.float64)
+        self.inputs = np.zeros((capacity, 2), dtype=np.int8)  # slide direction of player1, player2
+        self.slots = {}  # game_id -> row
+        self.free = list(range(capacity - 1, -1, -1))
+
+    def _grow(self):
+        capacity = len(self.bodies)
+        self.bodies = np.concatenate([self.bodies, np.zeros_like(self.bodies)])
+        self.inputs = np.concatenate([self.inputs, np.zeros_like(self.inputs)])
+        self.free.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def attach(self, game_id, game_state):
+        """Give the game a row (if it has none yet) and load its state into it."""
+        row = self.slots.get(game_id)
+        if row is None:
+            if not self.free:
+                self._grow()
+            row = self.free.pop()
+            self.slots[game_id] = row
+        self.load(row, game_state)
+        return row
+
+    def release(self, game_id):
+        row = self.slots.pop(game_id, None)
+        if row is not None:
+            self.free.append(row)
+
+    def load(self, row, game_state):
+        ball, player1, player2 = game_state.ball, game_state.player1, game_state.player2
+        self.bodies[row] = (ball.x, ball.y, ball.vx, ball.vy, player1.x, player1.y, player2.x, player2.y)
+
+    def store(self, row, game_state):
+        ball = game_state.ball
+        ball.x, ball.y, ball.vx, ball.vy, _, game_state.player1.y, _, game_state.player2.y = self.bodies[row].tolist()
+
+    def set_inputs(self, row, game_state):
+        self.inputs[row] = (game_state.player1.slide, game_state.player2.slide)
+
+    def step(self, paddle_mask, ball_mask):
+        """
+        Advance one fixed step. Paddles move in the rows of paddle_mask, the ball in the
+        rows of ball_mask. Returns an int8 array with PLAYER1_POINT / PLAYER2_POINT in the
+        rows where a point was scored.
+        """
+        b = self.bodies
+
+        # Paddles
+        for col, inputs in ((P1Y, self.inputs[:, 0]), (P2Y, self.inputs[:, 1])):
+            y = b[:, col]
+            y = np.where(paddle_mask & (inputs < 0), np.maximum(y - PADDLE_SPEED, 0), y)
+            y = np.where(paddle_mask & (inputs > 0), np.minimum(y + PADDLE_SPEED, SCREEN_HEIGHT - PADDLE_HEIGHT), y)
+            b[:, col] = y
+
+        x, y, vx, vy = b[:, BX], b[:, BY], b[:, VX], b[:, VY]
+        p1x, p1y, p2x, p2y = b[:, P1X], b[:, P1Y], b[:, P2X], b[:, P2Y]
+
+        # Predict the next position of the ball
+        next_x = x + vx
+        next_y = y + vy
+
+        # Wall collisions (top/bottom)
+        wall = (next_y <= 0) | (next_y >= SCREEN_HEIGHT)
+        vy = np.where(wall, -vy, vy)
+        next_y = np.where(wall, y + vy, next_y)
+
+        # player1's paddle, then player2's with the velocity left by the first check
+        hit = (vx < 0) & (next_x - BALL_RADIUS <= p1x) & (p1x <= x + BALL_RADIUS) & (p1y <= next_y) & (next_y <= p1y + PADDLE_HEIGHT)
+        vx = np.where(hit, -vx, vx)
+        vx, vy = self._adjust_velocity(hit, y, vx, vy, p1y)
+        next_x = np.where(hit & (next_x - BALL_RADIUS < p1x), p1x + BALL_RADIUS, next_x)
+
+        hit = (vx > 0) & (x - BALL_RADIUS <= p2x) & (p2x <= next_x + BALL_RADIUS) & (p2y <= next_y) & (next_y <= p2y + PADDLE_HEIGHT)
+        vx = np.where(hit, -vx, vx)
+        vx, vy = self._adjust_velocity(hit, y, vx, vy, p2y)
+        next_x = np.where(hit & (next_x + BALL_RADIUS > p2x), p2x - BALL_RADIUS, next_x)
+
+        b[:, BX] = np.where(ball_mask, next_x, x)
+        b[:, BY] = np.where(ball_mask, next_y, y)
+        b[:, VX] = np.where(ball_mask, vx, b[:, VX])
+        b[:, VY] = np.where(ball_mask, vy, b[:, VY])
+
+        points = np.full(len(b), NO_POINT, dtype=np.int8)
+        x = b[:, BX]
+        player2_point = ball_mask & (x <= 0 + EPSILON)
+        points[player2_point] = PLAYER2_POINT
+        points[ball_mask & ~player2_point & (x >= SCREEN_WIDTH - EPSILON)] = PLAYER1_POINT
+        return points
+
+    @staticmethod
+    def _adjust_velocity(hit, y, vx, vy, paddle_top_y):
+        """Vectorized utils.adjust_ball_velocity for the rows of `hit`."""
+        top_bound = paddle_top_y
+        bottom_bound = paddle_top_y + PADDLE_HEIGHT
+        within = hit & (top_bound <= y) & (y <= bottom_bound)
+        section_length = PADDLE_HEIGHT / 4
+        top = within & (y <= top_bound + section_length)
+        bottom = within & ~top & (y >= bottom_bound - section_length)
+        vy = np.where(top, -np.abs(vy), vy)
+        vy = np.where(bottom, np.abs(vy), vy)
+        vx = np.where(within, vx * BALL_SPEED_STEP, vx)
+        vy = np.where(within, vy * BALL_SPEED_STEP, vy)
+        return vx, vy
+
+    def advance(self, games, steps, step):
+        """Advance `games` by `steps` fixed steps in one batch. Returns a list of (game, scorer)."""
+        rows = []
+        for game in games:
+            row = self.slots.get(game.game_id)
+            if row is None or game.resync:
+                row = self.attach(game.game_id, game.game_state)
+                game.resync = False
+            self.set_inputs(row, game.game_state)
+            rows.append(row)
+
+        scorers = {}
+        live = list(zip(games, rows))
+        size = len(self.bodies)
+        for _ in range(steps):
+            if not live:
+                break
+            paddle_mask = np.zeros(size, dtype=bool)
+            ball_mask = np.zeros(size, dtype=bool)
+            for game, row in live:
+                paddle_mask[row] = True
+                ball_mask[row] = game.sim_time >= game.serve_at
+            points = self.step(paddle_mask, ball_mask)
+            still_live = []
+            for game, row in live:
+                game.sim_time += step
+                game.steps += 1
+                if points[row]:
+                    # a game that scored does not simulate the rest of the frame
+                    scorers[game.game_id] = SCORERS[int(points[row])]
+                else:
+                    still_live.append((game, row))
+            live = still_live
+
+        results = []
+        for game, row in zip(games, rows):
+            self.store(row, game.game_state)
+            scorer = scorers.get(game.game_id)
+            game.checkpoint()
+            if scorer:
+                game.add_point(scorer)
+            results.append((game, scorer))
+        return results
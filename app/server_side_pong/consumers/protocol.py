@@ -0,0 +1,137 @@
+import struct
+
+# Websocket subprotocol a client offers to receive gameplay frames in binary.
+# Clients that do not offer it keep receiving the JSON messages.
+BINARY_SUBPROTOCOL = "pong.binary.v1"
+
+# Every frame starts with a header: kind, mask of the fields that follow, sequence number.
+# The fields are then packed in the order of FIELDS, little-endian.
+HEADER = struct.Struct("<BBH")
+KEYFRAME, DELTA = 1, 2
+
+BALL_POSITION = 1 << 0
+BALL_VELOCITY = 1 << 1
+PADDLE1 = 1 << 2
+PADDLE2 = 1 << 3
+SCORES = 1 << 4
+ACKS = 1 << 5
+INTERVAL = 1 << 6
+
+FIELDS = (
+    (BALL_POSITION, struct.Struct("<2f")),  # ball x, y
+    (BALL_VELOCITY, struct.Struct("<2f")),  # ball vx, vy
+    (PADDLE1, struct.Struct("<f")),         # player1 y
+    (PADDLE2, struct.Struct("<f")),         # player2 y
+    (SCORES, struct.Struct("<2H")),         # player1, player2
+    (ACKS, struct.Struct("<2I")),           # last input sequence number applied for player1, player2
+    (INTERVAL, struct.Struct("<H")),        # milliseconds until the next frame, to interpolate in between
+)
+
+KEYFRAME_INTERVAL = 30  # a full frame every half second at 60 Hz
+NO_ACKS = {"player1": 0, "player2": 0}
+FRAME_INTERVAL_MS = 17  # one frame per tick at 60 Hz
+
+
+def frame_fields(game_state, acks, interval_ms=FRAME_INTERVAL_MS):
+    """Values of the fields of FIELDS for a game state, in the same order."""
+    ball = game_state.ball
+    return (
+        (ball.x, ball.y),
+        (ball.vx, ball.vy),
+        (game_state.player1.y,),
+        (game_state.player2.y,),
+        (game_state.score1, game_state.score2),
+        (acks["player1"] & 0xFFFFFFFF, acks["player2"] & 0xFFFFFFFF),
+        (interval_ms,),
+    )
+
+
+class FrameEncoder:
+    """
+    Encodes the gameplay frames of one game.
+
+    A delta frame only holds the fields that changed since the previous frame (in
+    play, usually the ball position alone). Every keyframe_interval frames, and
+    whenever request_keyframe() was called, a keyframe with every field is sent so a
+    client that just connected or missed a frame can resync.
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self.since_keyframe = 0
+        self.keyframe_requested = True
+        self.previous = None
+
+    def request_keyframe(self):
+        self.keyframe_requested = True
+
+    def encode(self, game_state, acks=NO_ACKS, interval_ms=FRAME_INTERVAL_MS):
+        values = frame_fields(game_state, acks, interval_ms)
+        keyframe = self.keyframe_requested or self.since_keyframe >= self.keyframe_interval
+        mask = 0
+        parts = []
+        for i, (bit, layout) in enumerate(FIELDS):
+            if keyframe or values[i] != self.previous[i]:
+                mask |= bit
+                parts.append(layout.pack(*values[i]))
+        data = HEADER.pack(KEYFRAME if keyframe else DELTA, mask, self.seq) + b"".join(parts)
+
+        self.previous = values
+        self.seq = (self.seq + 1) & 0xFFFF
+        if keyframe:
+            self.keyframe_requested = False
+            self.since_keyframe = 1
+        else:
+            self.since_keyframe += 1
+        return data
+
+
+def decode_frame(data):
+    """Returns (kind, seq, {bit: values}) for one encoded frame."""
+    kind, mask, seq = HEADER.unpack_from(data)
+    if kind not in (KEYFRAME, DELTA):
+        raise ValueError(f"Unknown frame kind {kind}")
+    offset = HEADER.size
+    fields = {}
+    for bit, layout in FIELDS:
+        if mask & bit:
+            fields[bit] = layout.unpack_from(data, offset)
+            offset += layout.size
+    if offset != len(data):
+        raise ValueError("Frame has trailing bytes")
+    return kind, seq, fields
+
+
+class FrameDecoder:
+    """
+    Rebuilds the gameplay state from a stream of frames, the way the browser client does
+    (static/front/utils/pong_protocol.js). Deltas received before the first keyframe are
+    dropped.
+    """
+
+    def __init__(self):
+        self.state = None
+
+    def apply(self, data):
+        kind, _, fields = decode_frame(data)
+        if kind == DELTA and self.state is None:
+            return None
+        if self.state is None:
+            self.state = {"ball": {}, "players": {"player1": {}, "player2": {}}, "scores": {}, "ack": {}, "interval": None}
+        ball, players, scores = self.state["ball"], self.state["players"], self.state["scores"]
+        if BALL_POSITION in fields:
+            ball["x"], ball["y"] = fields[BALL_POSITION]
+        if BALL_VELOCITY in fields:
+            ball["vx"], ball["vy"] = fields[BALL_VELOCITY]
+        if PADDLE1 in fields:
+            (players["player1"]["y"],) = fields[PADDLE1]
+        if PADDLE2 in fields:
+            (players["player2"]["y"],) = fields[PADDLE2]
+        if SCORES in fields:
+            scores["player1"], scores["player2"] = fields[SCORES]
+        if ACKS in fields:
+            self.state["ack"]["player1"], self.state["ack"]["player2"] = fields[ACKS]
+        if INTERVAL in fields:
+            (self.state["interval"],) = fields[INTERVAL]
+        return self.state
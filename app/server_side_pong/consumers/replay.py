@@ -0,0 +1,130 @@
+import struct, zlib
+from .state import GameState, STATE_LAYOUT
+
+# A replay is the list of the inputs applied by the game loop and of keyframes (the whole
+# state, see state.STATE_LAYOUT), each record prefixed by its kind and the tick it belongs to.
+# Records are buffered in memory and compressed into one chunk per round: chunks go to a
+# Redis list while the game is played, then are archived to the media storage as one file.
+REPLAY_KEY_PREFIX = "pong:replay:"
+REPLAY_DIR = "replays"
+REPLAY_MAGIC = b"PONGRPL1"
+KEYFRAME_INTERVAL = 30 # ticks between two keyframes
+
+RECORD = struct.Struct("<BI")  # kind, tick
+KEYFRAME = 1
+INPUT = 2
+INPUT_LAYOUT = struct.Struct("<Bb")  # role, slide direction
+CHUNK_SIZE = struct.Struct("<I")  # length of the compressed chunks in an archive
+
+ROLES = {"player1": 1, "player2": 2}
+ROLE_NAMES = {code: role for role, code in ROLES.items()}
+
+
+def replay_key(game_id):
+    return f"{REPLAY_KEY_PREFIX}{game_id}"
+
+
+def replay_path(game_id):
+    return f"{REPLAY_DIR}/game_{game_id}.pongreplay"
+
+
+class ReplayRecorder:
+    """
+    Records a game from the game loop. The per tick cost is a counter increment, and a
+    keyframe packed every keyframe_interval ticks; nothing leaves memory until take_chunk().
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.buffer = bytearray()
+        self.ticks = 0
+        self.next_keyframe = 0
+
+    def request_keyframe(self):
+        """Record the whole state at the next tick (start of a round, point scored)."""
+        self.next_keyframe = self.ticks
+
+    def input(self, role, slide):
+        """An input applied at the current tick, before the physics step."""
+        self.buffer += RECORD.pack(INPUT, self.ticks)
+        self.buffer += INPUT_LAYOUT.pack(ROLES[role], slide)
+
+    def tick(self, game_state, steps=1):
+        """
+        Called after the physics advanced the game `steps` fixed steps (more than one when
+        the engine catches up), so ticks count simulation steps, not frames.
+        """
+        self.ticks += steps
+        last = self.ticks - 1
+        if last >= self.next_keyframe:
+            self.buffer += RECORD.pack(KEYFRAME, last)
+            self.buffer += game_state.to_bytes()
+            self.next_keyframe = last + self.keyframe_interval
+
+    def take_chunk(self):
+        """The records since the last call, compressed, or None if there were none."""
+        if not self.buffer:
+            return None
+        chunk = zlib.compress(bytes(self.buffer))
+        self.buffer.clear()
+        return chunk
+
+
+def archive(chunks):
+    """Content of a replay file: the magic bytes, then each chunk prefixed by its length."""
+    parts = [REPLAY_MAGIC]
+    for chunk in chunks:
+        parts.append(CHUNK_SIZE.pack(len(chunk)))
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+def read_archive(data):
+    """The compressed chunks of a replay file."""
+    if not data.startswith(REPLAY_MAGIC):
+        raise ValueError("Not a replay file.")
+    offset = len(REPLAY_MAGIC)
+    while offset < len(data):
+        (size,) = CHUNK_SIZE.unpack_from(data, offset)
+        offset += CHUNK_SIZE.size
+        yield data[offset:offset + size]
+        offset += size
+
+
+def read_chunk(chunk):
+    """
+    Records of a compressed chunk: ("keyframe", tick, GameState) and ("input", tick, role, slide).
+    """
+    data = zlib.decompress(chunk)
+    offset = 0
+    while offset < len(data):
+        kind, tick = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if kind == KEYFRAME:
+            yield ("keyframe", tick, GameState.from_bytes(data[offset:offset + STATE_LAYOUT.size]))
+            offset += STATE_LAYOUT.size
+        elif kind == INPUT:
+            role, slide = INPUT_LAYOUT.unpack_from(data, offset)
+            yield ("input", tick, ROLE_NAMES[role], slide)
+            offset += INPUT_LAYOUT.size
+        else:
+            raise ValueError(f"Unknown replay record {kind}.")
+
+
+def replay_events(chunks, start=0):
+    """
+    JSON ready events of a replay, from the first keyframe at or after tick `start` so
+    a client seeking in the replay always starts from a whole state.
+    """
+    started = False
+    for chunk in chunks:
+        for record in read_chunk(chunk):
+            kind, tick = record[0], record[1]
+            if not started:
+                if kind != "keyframe" or tick < start:
+                    continue
+                started = True
+            if kind == "keyframe":
+                yield {"type": "keyframe", "tick": tick, "state": record[2].to_dict()}
+            else:
+                yield {"type": "input", "tick": tick, "role": record[2], "slide": record[3]}
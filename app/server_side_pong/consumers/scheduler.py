@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+
+class TickStats:
+    """Counters describing how well a loop keeps up with its tick rate."""
+    __slots__ = ("frames", "ticks", "overruns", "skipped", "jitter_total", "jitter_max")
+
+    def __init__(self):
+        self.frames = 0         # wake-ups of the loop
+        self.ticks = 0          # fixed steps simulated
+        self.overruns = 0       # frames whose deadline had already passed when the loop came back to wait
+        self.skipped = 0        # fixed steps dropped because the catch-up limit was reached
+        self.jitter_total = 0.0 # sum of wake-up lateness, in seconds
+        self.jitter_max = 0.0
+
+    def record(self, lateness, steps, skipped, overrun):
+        self.frames += 1
+        self.ticks += steps
+        self.skipped += skipped
+        if overrun:
+            self.overruns += 1
+        self.jitter_total += lateness
+        if lateness > self.jitter_max:
+            self.jitter_max = lateness
+
+    def as_dict(self):
+        return {
+            "frames": self.frames,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "jitter_avg_ms": round(self.jitter_total / self.frames * 1000, 3) if self.frames else 0,
+            "jitter_max_ms": round(self.jitter_max * 1000, 3),
+        }
+
+    def __str__(self):
+        return str(self.as_dict())
+
+
+class FixedTimestepScheduler:
+    """
+    Paces a loop at a fixed tick rate on the monotonic clock.
+
+    wait() sleeps until the next tick is due and returns how many fixed steps the caller
+    has to simulate to stay in sync with wall time. When the loop falls behind, at most
+    max_catchup steps are returned and the rest are dropped (counted in stats.skipped)
+    so an overloaded loop never spirals trying to catch up.
+    """
+
+    def __init__(self, tick_rate=60, max_catchup=5, stats=None):
+        self.step = 1 / tick_rate
+        self.max_catchup = max_catchup
+        self.stats = stats if stats is not None else TickStats()
+        self.next_tick = None
+        self.last_frame = (0.0, 0, 0, False)  # (lateness, steps, skipped, overrun) of the latest wait()
+
+    def start(self):
+        self.next_tick = time.monotonic() + self.step
+
+    async def wait(self):
+        if self.next_tick is None:
+            self.start()
+        delay = self.next_tick - time.monotonic()
+        overrun = delay <= 0
+        # always yield to the event loop, even when late
+        await asyncio.sleep(delay if delay > 0 else 0)
+
+        # the event loop may wake us up slightly before the deadline, which is not lateness
+        lateness = max(0.0, time.monotonic() - self.next_tick)
+        steps = 1 + int(lateness // self.step)
+        skipped = 0
+        if steps > self.max_catchup:
+            skipped = steps - self.max_catchup
+            steps = self.max_catchup
+        self.next_tick += (steps + skipped) * self.step
+        self.last_frame = (lateness, steps, skipped, overrun)
+        self.stats.record(*self.last_frame)
+        return steps
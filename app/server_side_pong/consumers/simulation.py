@@ -0,0 +1,82 @@
+import random
+from .physics import BALL_SPEED, SCREEN_WIDTH, SCREEN_HEIGHT, VXSPEED, VYSPEED, move_paddles, step_ball
+from .state import BallState
+
+SERVE_DELAY = 3 # seconds before the ball moves at the start of each round
+
+
+def serve_ball(rng):
+    """Ball in the middle of the screen, heading in a direction drawn from rng."""
+    return BallState(
+        SCREEN_WIDTH / 2,
+        SCREEN_HEIGHT / 2,
+        BALL_SPEED * (-VXSPEED if rng.random() < 0.5 else VXSPEED),
+        BALL_SPEED * (-VYSPEED if rng.random() < 0.5 else VYSPEED),
+    )
+
+
+class PongSimulation:
+    """
+    The rules of a match, without Django, Redis or the channel layer.
+
+    Every random draw goes through self.rng, so two simulations built with the same seed
+    and fed the same inputs at the same ticks play exactly the same match. TwoPlayerPong
+    adds persistence and networking on top; the benchmark command runs it bare.
+    The physics backends advance anything with this interface (see physics.py).
+    """
+
+    def __init__(self, game_id, game_state, seed=None):
+        self.game_id = game_id
+        self.game_state = game_state
+        self.rng = random.Random(seed)
+        self.resync = True  # tells a batched physics backend to reload the state
+        self.sim_time = 0
+        self.steps = 0  # fixed steps simulated, whatever the backend
+        self.serve_at = SERVE_DELAY
+
+    def checkpoint(self, force=False):
+        """Called whenever the state changed, TwoPlayerPong saves it from there."""
+
+    def move_paddles(self):
+        move_paddles(self.game_state)
+
+    def update_ball(self):
+        """Move the ball one step. Returns the role that scored, if any."""
+        scorer = step_ball(self.game_state)
+        self.checkpoint()
+        if scorer:
+            self.add_point(scorer)
+        return scorer
+
+    def add_point(self, role):
+        self.game_state.add_point(role)
+        self.checkpoint(force=True)
+
+    def advance(self, steps, step):
+        """Simulate `steps` fixed steps of `step` seconds. Returns the role that scored, if any."""
+        scorer = None
+        for _ in range(steps):
+            self.move_paddles()
+            if self.sim_time >= self.serve_at:
+                scorer = self.update_ball()
+            self.sim_time += step
+            self.steps += 1
+            if scorer:
+                break
+        self.checkpoint()
+        return scorer
+
+    def winner(self, rounds_needed):
+        """Role that reached rounds_needed, None while the match goes on."""
+        if self.game_state.score1 >= rounds_needed:
+            return "player1"
+        if self.game_state.score2 >= rounds_needed:
+            return "player2"
+        return None
+
+    def next_round(self):
+        """Serve a new ball after SERVE_DELAY seconds of simulated time."""
+        self.game_state.ball = serve_ball(self.rng)
+        self.resync = True
+        self.checkpoint()
+        self.serve_at = self.sim_time + SERVE_DELAY
@@ -0,0 +1,184 @@
+import struct
+from typing import NamedTuple
+
+# Version byte, ball (x, y, vx, vy), player1 (x, y), player2 (x, y), slide directions,
+# user ids (NO_USER when the seat is free) and scores
+STATE_VERSION = 1
+STATE_LAYOUT = struct.Struct("<B4d2d2d2b2q2H")
+NO_USER = -1
+
+# In Redis a game is a hash: the moving parts are packed in the "bodies" field (version
+# byte, ball, paddles, slide directions) and the user ids and scores are fields of their
+# own, so players can be seated and points counted atomically without rewriting the state.
+BODIES_VERSION = 1
+BODIES_LAYOUT = struct.Struct("<B4d2d2d2b")
+
+
+class BallState:
+    __slots__ = ("x", "y", "vx", "vy")
+
+    def __init__(self, x, y, vx, vy):
+        self.x = x
+        self.y = y
+        self.vx = vx
+        self.vy = vy
+
+    def to_dict(self):
+        return {"x": self.x, "y": self.y, "vx": self.vx, "vy": self.vy}
+
+
+class PaddleState:
+    __slots__ = ("x", "y", "slide", "user_id")
+
+    def __init__(self, x, y, slide=0, user_id=None):
+        self.x = x
+        self.y = y
+        self.slide = slide  # input of the player: -1 up, 1 down, 0 still
+        self.user_id = user_id
+
+    def to_dict(self):
+        return {"x": self.x, "y": self.y, "slide": self.slide, "user_id": self.user_id}
+
+
+class GameState:
+    """
+    State of one pong game: the ball, both paddles with their inputs, and the scores.
+
+    Attributes are fixed by __slots__, so a misspelt field raises instead of silently
+    creating a new key, and to_bytes()/from_bytes() store it in a fixed binary layout.
+    """
+    __slots__ = ("ball", "player1", "player2", "score1", "score2")
+
+    def __init__(self, ball, player1, player2, score1=0, score2=0):
+        self.ball = ball
+        self.player1 = player1
+        self.player2 = player2
+        self.score1 = score1
+        self.score2 = score2
+
+    def paddle(self, role):
+        if role == "player1":
+            return self.player1
+        if role == "player2":
+            return self.player2
+        raise ValueError(f"Unknown role {role}")
+
+    def add_point(self, role):
+        if role == "player1":
+            self.score1 += 1
+        elif role == "player2":
+            self.score2 += 1
+        else:
+            raise ValueError(f"Unknown role {role}")
+
+    @property
+    def scores(self):
+        return {"player1": self.score1, "player2": self.score2}
+
+    def to_dict(self):
+        """Same shape as the historical dict state, used for the JSON messages."""
+        return {
+            "ball": self.ball.to_dict(),
+            "players": {"player1": self.player1.to_dict(), "player2": self.player2.to_dict()},
+            "scores": self.scores,
+        }
+
+    def to_bytes(self):
+        ball, p1, p2 = self.ball, self.player1, self.player2
+        return STATE_LAYOUT.pack(
+            STATE_VERSION,
+            ball.x, ball.y, ball.vx, ball.vy,
+            p1.x, p1.y, p2.x, p2.y,
+            p1.slide, p2.slide,
+            NO_USER if p1.user_id is None else p1.user_id,
+            NO_USER if p2.user_id is None else p2.user_id,
+            self.score1, self.score2,
+        )
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) != STATE_LAYOUT.size or data[0] != STATE_VERSION:
+            raise ValueError("Game state has an unknown layout.")
+        (_, bx, by, vx, vy, p1x, p1y, p2x, p2y, slide1, slide2,
+         user1, user2, score1, score2) = STATE_LAYOUT.unpack(data)
+        return cls(
+            BallState(bx, by, vx, vy),
+            PaddleState(p1x, p1y, slide1, None if user1 == NO_USER else user1),
+            PaddleState(p2x, p2y, slide2, None if user2 == NO_USER else user2),
+            score1, score2,
+        )
+
+    def bodies_to_bytes(self):
+        ball, p1, p2 = self.ball, self.player1, self.player2
+        return BODIES_LAYOUT.pack(
+            BODIES_VERSION,
+            ball.x, ball.y, ball.vx, ball.vy,
+            p1.x, p1.y, p2.x, p2.y,
+            p1.slide, p2.slide,
+        )
+
+    def to_hash(self):
+        """Fields of the Redis hash of the game (free seats have no field)."""
+        fields = {"bodies": self.bodies_to_bytes(), "score1": self.score1, "score2": self.score2}
+        if self.player1.user_id is not None:
+            fields["player1"] = self.player1.user_id
+        if self.player2.user_id is not None:
+            fields["player2"] = self.player2.user_id
+        return fields
+
+    @classmethod
+    def from_hash(cls, fields):
+        """Rebuild a state from HGETALL, whose keys and values are bytes."""
+        bodies = fields.get(b"bodies")
+        if bodies is None or len(bodies) != BODIES_LAYOUT.size or bodies[0] != BODIES_VERSION:
+            raise ValueError("Game state has an unknown layout.")
+        _, bx, by, vx, vy, p1x, p1y, p2x, p2y, slide1, slide2 = BODIES_LAYOUT.unpack(bodies)
+        user1, user2 = fields.get(b"player1"), fields.get(b"player2")
+        return cls(
+            BallState(bx, by, vx, vy),
+            PaddleState(p1x, p1y, slide1, None if user1 is None else int(user1)),
+            PaddleState(p2x, p2y, slide2, None if user2 is None else int(user2)),
+            int(fields.get(b"score1", 0)), int(fields.get(b"score2", 0)),
+        )
+
+
+class MatchDescriptor(NamedTuple):
+    """What the game loop and the consumers need from the Game row; none of it changes once the game started."""
+    game_id: int
+    rounds_needed: int
+    tournament_id: int | None
+    game_type: str
+    player1_id: int | None  # Player ids, the same as the user ids
+    player2_id: int | None
+    player1_nickname: str | None
+    player2_nickname: str | None
+
+    @classmethod
+    def from_game(cls, game):
+        """Build from a Game loaded with select_related("player1", "player2")."""
+        return cls(
+            game.id, game.rounds_needed, game.tournament_id, game.game_type,
+            game.player1_id, game.player2_id,
+            game.player1.nickname if game.player1 else None,
+            game.player2.nickname if game.player2 else None,
+        )
+
+    @property
+    def is_tournament(self):
+        return self.tournament_id is not None
+
+    def player_id(self, role):
+        return self.player1_id if role == "player1" else self.player2_id
+
+    def nickname(self, role):
+        return self.player1_nickname if role == "player1" else self.player2_nickname
+
+    def role_of(self, user_id):
+        if user_id == self.player1_id:
+            return "player1"
+        if user_id == self.player2_id:
+            return "player2"
+        return None
+
+    def opponent(self, role):
+        return "player2" if role == "player1" else "player1"
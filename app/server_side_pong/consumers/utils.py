@@ -36,22 +36,22 @@ def adjust_ball_velocity(ball, paddle_top_y, paddle_length, speed_increment):
     bottom_bound = paddle_top_y + paddle_length
 
     # Check if the ball is within the paddle's vertical range
-    if top_bound <= ball["y"] <= bottom_bound:
+    if top_bound <= ball.y <= bottom_bound:
         # Calculate the paddle's sections
         section_length = paddle_length / 4
         top_section = top_bound + section_length
         bottom_section = bottom_bound - section_length
 
         # Determine which section the ball hit
-        if ball["y"] <= top_section:
+        if ball.y <= top_section:
             # Top section: Reflect upward
-            ball["vy"] = -abs(ball["vy"])  # Ensure it moves upward
-        elif ball["y"] >= bottom_section:
+            ball.vy = -abs(ball.vy)  # Ensure it moves upward
+        elif ball.y >= bottom_section:
             # Bottom section: Reflect downward
-            ball["vy"] = abs(ball["vy"])  # Ensure it moves downward
+            ball.vy = abs(ball.vy)  # Ensure it moves downward
             
-        ball["vx"] *= speed_increment  # Optional: Add slight speed increase
-        ball["vy"] *= speed_increment
+        ball.vx *= speed_increment  # Optional: Add slight speed increase
+        ball.vy *= speed_increment
 
 from django.contrib.auth import get_user_model
 from matchmaking.models import Player
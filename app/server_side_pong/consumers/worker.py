@@ -0,0 +1,52 @@
+import asyncio, logging
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+
+class PongWorker:
+    """
+    Identity of this process for game ownership.
+
+    The process listens on its own channel, and the owner of a game is recorded in
+    Redis as the name of that channel, so any other process can forward what it
+    receives for the game with a plain channel_layer.send(). Messages are dispatched
+    like consumer events: {"type": "game.input"} calls target.game_input(message).
+    """
+
+    def __init__(self, target, channel_layer=None):
+        self.target = target
+        self.channel_layer = channel_layer
+        self.channel_name = None
+        self.task = None
+        self.loop = None
+
+    async def get_channel_name(self):
+        """Name of the channel of this process, the inbox is opened on first use."""
+        loop = asyncio.get_running_loop()
+        if self.channel_name is None or self.loop is not loop:
+            if self.channel_layer is None:
+                self.channel_layer = get_channel_layer()
+            self.loop = loop
+            self.channel_name = await self.channel_layer.new_channel("pong_worker")
+            self.task = asyncio.create_task(self.listen())
+            logger.info(f"Pong worker listening on {self.channel_name}")
+        return self.channel_name
+
+    async def send(self, channel_name, message):
+        if self.channel_layer is None:
+            self.channel_layer = get_channel_layer()
+        await self.channel_layer.send(channel_name, message)
+
+    async def listen(self):
+        channel_name = self.channel_name
+        while True:
+            message = await self.channel_layer.receive(channel_name)
+            handler = getattr(self.target, message["type"].replace(".", "_"), None)
+            if handler is None:
+                logger.warning(f"Pong worker got an unknown message type {message['type']}")
+                continue
+            try:
+                await handler(message)
+            except Exception:
+                logger.exception(f"Pong worker failed to handle {message['type']}")
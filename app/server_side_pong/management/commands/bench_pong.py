@@ -0,0 +1,144 @@
+import random, sys, time, tracemalloc
+from django.core.management.base import BaseCommand
+from server_side_pong.consumers.consumers import GameManager
+from server_side_pong.consumers.physics import PADDLE_HEIGHT, get_physics_backend
+from server_side_pong.consumers.protocol import FrameEncoder
+from server_side_pong.consumers.simulation import PongSimulation
+
+
+class ScriptedPlayer:
+    """Follows the ball when it comes its way, aiming at a spot of the paddle drawn at each serve, so it misses now and then."""
+
+    def __init__(self, role, rng):
+        self.role = role
+        self.rng = rng
+        self.aim = 0
+
+    def slide(self, game_state):
+        ball = game_state.ball
+        paddle = game_state.paddle(self.role)
+        coming = ball.vx < 0 if self.role == "player1" else ball.vx > 0
+        if not coming:
+            return 0
+        target = paddle.y + PADDLE_HEIGHT / 2 + self.aim
+        if ball.y < target - 1:
+            return -1
+        if ball.y > target + 1:
+            return 1
+        return 0
+
+    def new_round(self):
+        self.aim = self.rng.uniform(-PADDLE_HEIGHT, PADDLE_HEIGHT)
+
+
+class Match:
+    """A simulated match, its scripted players and the frame encoder the engine would use."""
+
+    def __init__(self, game_id, seed):
+        rng = random.Random(seed)
+        self.simulation = PongSimulation(game_id, GameManager.new_game_state(), seed=rng.random())
+        self.players = [ScriptedPlayer("player1", rng), ScriptedPlayer("player2", rng)]
+        self.encoder = FrameEncoder()
+        for player in self.players:
+            player.new_round()
+
+    def play_inputs(self):
+        game_state = self.simulation.game_state
+        for player in self.players:
+            game_state.paddle(player.role).slide = player.slide(game_state)
+
+
+class Command(BaseCommand):
+    help = "Simulate pong matches with scripted players, without Redis or websockets, and report the tick loop throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--matches", type=int, default=100, help="Matches played at the same time")
+        parser.add_argument("--rounds", type=int, default=5, help="Points needed to win a match")
+        parser.add_argument("--seed", type=int, default=0, help="Same seed, same matches")
+        parser.add_argument("--backend", default="python", help="Physics backend, 'python' or 'numpy'")
+        parser.add_argument("--tick-rate", type=int, default=60)
+        parser.add_argument("--max-ticks", type=int, default=100000, help="Stop there if some matches are not over")
+        parser.add_argument("--alloc-ticks", type=int, default=300, help="Ticks measured again under tracemalloc")
+
+    def handle(self, *args, **options):
+        step = 1 / options["tick_rate"]
+
+        durations, results, ticks, game_ticks = self.run(options, step)
+        durations.sort()
+        total = sum(durations)
+        allocated, retained = self.measure_allocations(options, step)
+
+        self.stdout.write(f"matches: {options['matches']} ({options['backend']} physics), finished: {len(results)}, ticks: {ticks}")
+        self.stdout.write(f"ticks/sec: {ticks / total:.1f}, game ticks/sec: {game_ticks / total:.1f}")
+        self.stdout.write(
+            f"tick latency ms: p50 {durations[len(durations) // 2] * 1000:.3f}, "
+            f"p99 {durations[min(len(durations) - 1, int(len(durations) * 0.99))] * 1000:.3f}, "
+            f"max {durations[-1] * 1000:.3f}"
+        )
+        self.stdout.write(f"allocated per tick: {allocated:.0f} bytes, blocks retained per tick: {retained:.2f}")
+        self.stdout.write(self.style.SUCCESS(f"scores: {self.fingerprint(results)}"))
+
+    def run(self, options, step):
+        """
+        Play every match to the end. Returns the tick durations, {game_id: (scores, ticks)},
+        the number of ticks and the number of game ticks (ticks times matches still playing).
+        """
+        physics = get_physics_backend(options["backend"], True)
+        matches = {game_id: Match(game_id, options["seed"] + game_id) for game_id in range(options["matches"])}
+        durations = []
+        results = {}
+        ticks = 0
+        game_ticks = 0
+        while matches and ticks < options["max_ticks"]:
+            game_ticks += len(matches)
+            started = time.perf_counter()
+            self.tick(matches, physics, step, options["rounds"], results, ticks)
+            durations.append(time.perf_counter() - started)
+            ticks += 1
+        return durations, results, ticks, game_ticks
+
+    def tick(self, matches, physics, step, rounds, results, ticks):
+        """What PongEngine.tick does for a game, minus Redis and the channel layer."""
+        for match in matches.values():
+            match.play_inputs()
+        simulations = [match.simulation for match in matches.values()]
+        for simulation, scorer in physics.advance(simulations, 1, step):
+            match = matches[simulation.game_id]
+            match.encoder.encode(simulation.game_state)
+            if not scorer:
+                continue
+            if simulation.winner(rounds):
+                results[simulation.game_id] = (simulation.game_state.scores, ticks + 1)
+                del matches[simulation.game_id]
+                physics.release(simulation.game_id)
+            else:
+                simulation.next_round()
+                for player in match.players:
+                    player.new_round()
+
+    def measure_allocations(self, options, step):
+        """Average bytes allocated during a tick, and blocks still alive after it (leaks show up there)."""
+        if options["alloc_ticks"] <= 0:
+            return 0, 0
+        physics = get_physics_backend(options["backend"], True)
+        matches = {game_id: Match(game_id, options["seed"] + game_id) for game_id in range(options["matches"])}
+        allocated = 0
+        tracemalloc.start()
+        blocks = sys.getallocatedblocks()
+        try:
+            for ticks in range(options["alloc_ticks"]):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                self.tick(matches, physics, step, options["rounds"], {}, ticks)
+                allocated += tracemalloc.get_traced_memory()[1] - before
+        finally:
+            tracemalloc.stop()
+        retained = sys.getallocatedblocks() - blocks
+        return allocated / options["alloc_ticks"], retained / options["alloc_ticks"]
+
+    @staticmethod
+    def fingerprint(results):
+        """Final scores of the matches, to check that a change of the engine kept it deterministic."""
+        player1 = sum(scores["player1"] for scores, _ in results.values())
+        player2 = sum(scores["player2"] for scores, _ in results.values())
+        return f"{player1}-{player2} after {sum(ticks for _, ticks in results.values())} game ticks"
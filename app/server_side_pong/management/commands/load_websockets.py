@@ -0,0 +1,233 @@
+import asyncio, json, resource, time, uuid
+from asgiref.sync import sync_to_async
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from server_side_pong.models import Game
+
+User = get_user_model()
+
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+def percentiles(samples):
+    """p50/p90/p99/max of samples (seconds), in milliseconds."""
+    if not samples:
+        return "no samples"
+    samples = sorted(samples)
+    def at(ratio):
+        return samples[min(len(samples) - 1, int(len(samples) * ratio))] * 1000
+    return f"p50 {at(0.5):.2f}, p90 {at(0.9):.2f}, p99 {at(0.99):.2f}, max {samples[-1] * 1000:.2f} ms ({len(samples)} samples)"
+
+
+class Stats:
+    def __init__(self):
+        self.connect = []       # connect handshake, per client
+        self.frame_gaps = []    # time between two gameplay frames received by a player
+        self.delivery = []      # gameplay frame sent by the server -> received by a player
+        self.input_acks = []    # input sent -> first frame acknowledging it
+        self.chat = []          # chat message sent -> broadcast received by its sender
+        self.failures = 0       # handshakes refused or timed out
+        self.slow_closes = 0    # disconnections the application took more than a second to handle
+
+
+class LoadClient:
+    """A websocket client talking to the ASGI application in this process, authenticated with the JWT cookie."""
+
+    def __init__(self, application, path, user, stats):
+        token = str(AccessToken.for_user(user))
+        self.communicator = WebsocketCommunicator(application, path, headers=[(b"cookie", f"access={token}".encode())])
+        self.user = user
+        self.stats = stats
+
+    async def connect(self):
+        started = time.perf_counter()
+        connected, _ = await self.communicator.connect(timeout=10)
+        if not connected:
+            self.stats.failures += 1
+            return False
+        self.stats.connect.append(time.perf_counter() - started)
+        return True
+
+    async def receive(self, timeout):
+        try:
+            return json.loads(await self.communicator.receive_from(timeout=timeout))
+        except (asyncio.TimeoutError, ValueError):
+            return None
+
+    async def close(self):
+        try:
+            await self.communicator.disconnect(timeout=1)
+        except asyncio.TimeoutError:
+            self.stats.slow_closes += 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Connect simulated pong players and chat users to the ASGI application of this process "
+        "and report connect latency, frame delivery latency and CPU usage"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--games", type=int, default=50, help="Remote games, two players each")
+        parser.add_argument("--chatters", type=int, default=100, help="Users of the general chat")
+        parser.add_argument("--duration", type=float, default=20, help="Seconds of play once everybody is connected")
+        parser.add_argument("--input-interval", type=float, default=0.25, help="Seconds between two inputs of a player")
+        parser.add_argument("--chat-interval", type=float, default=2, help="Seconds between two messages of a chat user")
+        parser.add_argument("--messages", type=int, default=0, help="Messages sent by each chat user, 0 to chat until --duration")
+        parser.add_argument("--connect-concurrency", type=int, default=200, help="Handshakes in flight at once")
+        parser.add_argument("--channel-layer", choices=["settings", "memory"], default="settings",
+                            help="'memory' swaps CHANNEL_LAYERS for the in-memory layer (games still need Redis)")
+        parser.add_argument("--allow-prod", action="store_true", help="Run even though DEBUG is off")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options["allow_prod"]:
+            raise CommandError("DEBUG is off, this may be a production database: pass --allow-prod to run anyway")
+        self.game_ids = []
+        users = self.create_users(options["games"] * 2 + options["chatters"])
+        try:
+            if options["channel_layer"] == "memory":
+                with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+                    channel_layers.backends.clear()
+                    try:
+                        stats, wall, cpu = asyncio.run(self.run(users, options))
+                    finally:
+                        channel_layers.backends.clear()
+            else:
+                stats, wall, cpu = asyncio.run(self.run(users, options))
+        finally:
+            # nothing of the run stays behind: no account to log into, no game in the statistics
+            Game.objects.filter(id__in=self.game_ids).delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+        self.report(stats, wall, cpu, options)
+
+    def create_users(self, count):
+        """
+        Users loadtest_<run>_<n> for this run only (their Player comes from the signal). They
+        cannot log in, the clients authenticate with tokens minted here.
+        """
+        run = uuid.uuid4().hex[:8]
+        users = []
+        for n in range(count):
+            user = User(username=f"loadtest_{run}_{n}", email=f"loadtest_{run}_{n}@example.com")
+            user.set_unusable_password()
+            user.save()
+            users.append(user)
+        return users
+
+    async def run(self, users, options):
+        from hello_django.asgi import application
+        stats = Stats()
+        semaphore = asyncio.Semaphore(options["connect_concurrency"])
+        players, chatters = users[:options["games"] * 2], users[options["games"] * 2:]
+
+        started = time.perf_counter()
+        cpu_started = resource.getrusage(resource.RUSAGE_SELF)
+        games = [
+            self.play_game(application, players[n], players[n + 1], stats, semaphore, options)
+            for n in range(0, len(players), 2)
+        ]
+        chats = [self.chat(application, user, stats, semaphore, options) for user in chatters]
+        await asyncio.gather(*games, *chats)
+        cpu_ended = resource.getrusage(resource.RUSAGE_SELF)
+
+        cpu = (cpu_ended.ru_utime - cpu_started.ru_utime) + (cpu_ended.ru_stime - cpu_started.ru_stime)
+        return stats, time.perf_counter() - started, cpu
+
+    async def connect(self, client, semaphore):
+        async with semaphore:
+            return await client.connect()
+
+    async def play_game(self, application, user1, user2, stats, semaphore, options):
+        from server_side_pong.consumers.consumers import GameManager
+        game = await sync_to_async(Game.objects.create)(
+            name=f"loadtest {uuid.uuid4().hex[:12]}", rounds_needed=1000, game_type="remote",
+            created_by_id=user1.id,
+        )
+        self.game_ids.append(game.id)
+        await GameManager.acreate_game(game.id)
+
+        path = f"/ws/server_side_pong/remote/{game.id}/"
+        clients = [LoadClient(application, path, user1, stats), LoadClient(application, path, user2, stats)]
+        try:
+            # the second player starts the game, the first one must be seated before
+            for client in clients:
+                if not await self.connect(client, semaphore):
+                    return
+            deadline = time.monotonic() + options["duration"]
+            await asyncio.gather(*(self.play(client, deadline, stats, options) for client in clients))
+        finally:
+            for client in clients:
+                await client.close()
+
+    async def play(self, client, deadline, stats, options):
+        """Alternate up and down inputs and time the frames and the acknowledgments."""
+        role = None
+        seq = 0
+        sent = {}  # seq -> time sent, until acknowledged
+        last_frame = None
+        next_input = time.monotonic()
+        while time.monotonic() < deadline:
+            if role is not None and time.monotonic() >= next_input:
+                seq += 1
+                action = "keydown" if seq % 2 else "keyup"
+                await client.communicator.send_to(text_data=json.dumps(
+                    {"type": "gameplay", "action": action, "movement": "w" if seq % 4 == 1 else "s", "seq": seq}
+                ))
+                sent[seq] = time.perf_counter()
+                next_input = time.monotonic() + options["input_interval"]
+
+            message = await client.receive(timeout=max(0.01, min(1, deadline - time.monotonic())))
+            if message is None:
+                continue
+            if message.get("type") == "role_assignment":
+                role = message["role"]
+            elif message.get("type") == "gameplay":
+                if "sent" in message:
+                    stats.delivery.append(max(0.0, time.time() - message["sent"]))
+                now = time.perf_counter()
+                if last_frame is not None:
+                    stats.frame_gaps.append(now - last_frame)
+                last_frame = now
+                acked = (message.get("ack") or {}).get(role, 0)
+                for done in [n for n in sent if n <= acked]:
+                    stats.input_acks.append(now - sent.pop(done))
+
+    async def chat(self, application, user, stats, semaphore, options):
+        client = LoadClient(application, "/ws/chat/loadtest/", user, stats)
+        if not await self.connect(client, semaphore):
+            return
+        try:
+            deadline = time.monotonic() + options["duration"]
+            count = 0
+            while time.monotonic() < deadline and (not options["messages"] or count < options["messages"]):
+                count += 1
+                text = f"load {user.id} {count}"
+                sent = time.perf_counter()
+                await client.communicator.send_to(text_data=json.dumps({
+                    "type": "chat_message", "message": text, "username": user.username,
+                    "avatarUrl": "", "userID": user.id, "room": "loadtest",
+                }))
+                # everybody's messages come in, wait for ours
+                while time.monotonic() < deadline:
+                    message = await client.receive(timeout=max(0.01, deadline - time.monotonic()))
+                    if message is not None and message.get("message") == text:
+                        stats.chat.append(time.perf_counter() - sent)
+                        break
+                await asyncio.sleep(options["chat_interval"])
+        finally:
+            await client.close()
+
+    def report(self, stats, wall, cpu, options):
+        self.stdout.write(f"clients: {options['games'] * 2} players in {options['games']} games, {options['chatters']} chat users, failures: {stats.failures}, slow closes: {stats.slow_closes}")
+        self.stdout.write(f"connect latency: {percentiles(stats.connect)}")
+        self.stdout.write(f"frame delivery (server send to receive): {percentiles(stats.delivery)}")
+        self.stdout.write(f"frame interval: {percentiles(stats.frame_gaps)}")
+        self.stdout.write(f"input to acknowledging frame: {percentiles(stats.input_acks)}")
+        self.stdout.write(f"chat message round trip: {percentiles(stats.chat)}")
+        # the simulated clients run in this process too, so this is an upper bound of the server's share
+        self.stdout.write(self.style.SUCCESS(f"CPU: {cpu:.2f}s over {wall:.2f}s of wall time ({cpu / wall * 100:.1f}% of one core)"))
@@ -33,6 +33,8 @@ class Game(models.Model):
     created_by = models.ForeignKey('matchmaking.Player', on_delete=models.SET_NULL, null=True, blank=True, related_name='created_games')
     game_type =  models.CharField(max_length=10, choices=TYPE_CHOICES)
     winner = models.ForeignKey('matchmaking.Player', on_delete=models.SET_NULL, null=True, blank=True, related_name='games_won')
+    # set once the result is counted in the players' statistics (matchmaking.signals.update_player_statistics)
+    stats_recorded = models.BooleanField(default=False)
 
 #what / who uses this ?
     def create_guest_user(self):
@@ -1,5 +1,5 @@
 from django.urls import path
-from server_side_pong.consumers.consumers import LocalPongConsumer, RemotePongConsumer
+from server_side_pong.consumers.consumers import LocalPongConsumer, RemotePongConsumer, SpectatorPongConsumer
 
 websocket_urlpatterns = [
 	
@@ -8,4 +8,7 @@ websocket_urlpatterns = [
 
     # Remote games (game_id included in the path)
     path('ws/server_side_pong/remote/<int:game_id>/', RemotePongConsumer.as_asgi(), name='remote_game'),
+
+    # Spectators of a game (read only, lower frame rate)
+    path('ws/server_side_pong/spectate/<int:game_id>/', SpectatorPongConsumer.as_asgi(), name='spectate_game'),
 ]
\ No newline at end of file
@@ -0,0 +1,99 @@
+from celery import shared_task
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from hello_django.redis_clients import get_redis
+from .models import Game
+from .consumers.consumers import GAME_KEY_PREFIX, OWNER_KEY_PREFIX
+from .consumers.replay import archive, replay_key, replay_path
+import logging
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("completed", "interrupted")
+SCAN_COUNT = 500
+
+
+def game_ids_to_reap(game_ids):
+    """Ids, among game_ids, of the games that are over or no longer in the database."""
+    game_ids = set(game_ids)
+    live = set(
+        Game.objects.filter(id__in=game_ids)
+        .exclude(status__in=FINISHED_STATUSES)
+        .values_list("id", flat=True)
+    )
+    return game_ids - live
+
+
+def scan_game_ids(redis_client, prefix):
+    """{game_id: key} for every key of prefix."""
+    keys = {}
+    for key in redis_client.scan_iter(match=f"{prefix}[0-9]*", count=SCAN_COUNT):
+        suffix = key.decode()[len(prefix):]
+        if suffix.isdigit():
+            keys[int(suffix)] = key
+    return keys
+
+
+@shared_task
+def reap_pong_keys():
+    """
+    Task deleting the Redis keys of pong games the database says are over (or that
+    were deleted), in case the game loop or the consumers did not get to clean them
+    up. The bare integer keys of the old storage layout go through the same check, a game
+    still played under the old layout keeps its state.
+    """
+    try:
+        logger.info("Starting reap_pong_keys task.")
+        redis_client = get_redis()
+
+        game_keys = scan_game_ids(redis_client, GAME_KEY_PREFIX)
+        owner_keys = scan_game_ids(redis_client, OWNER_KEY_PREFIX)
+        legacy_keys = scan_game_ids(redis_client, "")
+
+        to_reap = game_ids_to_reap(game_keys.keys() | owner_keys.keys() | legacy_keys.keys())
+        keys = [
+            prefixed[game_id]
+            for prefixed in (game_keys, owner_keys, legacy_keys)
+            for game_id in to_reap if game_id in prefixed
+        ]
+        if not keys:
+            logger.info("No pong keys to reap.")
+            return {"keys": 0, "bytes": 0}
+
+        pipe = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.memory_usage(key)
+        reclaimed = sum(size or 0 for size in pipe.execute())
+        deleted = redis_client.delete(*keys)
+
+        logger.info(f"Reaped {deleted} pong keys of {len(to_reap)} finished games, reclaimed {reclaimed} bytes.")
+        return {"keys": deleted, "bytes": reclaimed}
+
+    except Exception as e:
+        logger.exception(f"Error in reap_pong_keys task: {e}")
+
+
+@shared_task
+def archive_replay(game_id):
+    """
+    Task moving the replay chunks the game loop pushed to Redis into one file of the
+    media storage, where the replay endpoint reads them from once the game is over.
+    """
+    try:
+        redis_client = get_redis()
+        chunks = redis_client.lrange(replay_key(game_id), 0, -1)
+        if not chunks:
+            logger.info(f"No replay to archive for game {game_id}.")
+            return None
+
+        path = replay_path(game_id)
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        saved = default_storage.save(path, ContentFile(archive(chunks)))
+        redis_client.delete(replay_key(game_id))
+
+        logger.info(f"Archived the replay of game {game_id} ({len(chunks)} chunks) to {saved}.")
+        return saved
+
+    except Exception as e:
+        logger.exception(f"Error in archive_replay task for game {game_id}: {e}")
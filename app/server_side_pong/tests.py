@@ -1,17 +1,51 @@
+import asyncio
+import copy
+import fnmatch
+import json
+import random
+import time
+from datetime import timedelta
+from io import StringIO
 import pytest
 import pytest_asyncio
 from asgiref.sync import sync_to_async
-from rest_framework.test import APIClient
-from rest_framework import status
+from channels.layers import InMemoryChannelLayer
+from channels.routing import URLRouter
 from channels.testing import WebsocketCommunicator
-from asgiref.sync import sync_to_async
-from hello_django.asgi import application
-from server_side_pong.models import Game
-from matchmaking.models import Player
-from users.models import CustomUser
-from server_side_pong.consumers.consumers import GameManager
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
 from rest_framework_simplejwt.tokens import RefreshToken
+from hello_django.asgi import application
+from hello_django.redis_clients import get_async_script
+from matchmaking.models import Player, PlayerStatistics, Tournament
+from users.models import CustomUser
+from server_side_pong import tasks
+from server_side_pong.models import Game
+from server_side_pong.routing import websocket_urlpatterns
+from server_side_pong.tasks import game_ids_to_reap
+from server_side_pong.consumers import consumers, metrics, scheduler as scheduler_module
+from server_side_pong.consumers.consumers import GameManager, GameplayProtocolMixin, TwoPlayerPong, JOIN_GAME_SCRIPT
+from server_side_pong.consumers.engine import PongEngine, spawn
+from server_side_pong.consumers.persistence import PersistenceQueue, MatchResult, write_results
+from server_side_pong.consumers.physics import PythonPhysics, move_paddles, step_ball
+from server_side_pong.consumers.protocol import (
+    FrameEncoder, FrameDecoder, decode_frame, KEYFRAME, DELTA, BALL_POSITION,
+)
+from server_side_pong.consumers.replay import (
+    ReplayRecorder, archive, read_archive, read_chunk, replay_events, replay_path,
+)
+from server_side_pong.consumers.scheduler import FixedTimestepScheduler
+from server_side_pong.consumers.simulation import PongSimulation
+from server_side_pong.consumers.state import GameState, BallState, PaddleState, MatchDescriptor
+from server_side_pong.consumers.worker import PongWorker
 
 User = get_user_model()
 
@@ -247,18 +281,6 @@ class TestGameViewSet:
         assert response.status_code == 400
 
 
-
-
-from rest_framework.test import APITestCase, APIClient
-from django.urls import reverse
-from rest_framework import status
-from django.contrib.auth import get_user_model
-from matchmaking.models import Tournament
-from server_side_pong.models import Game
-from django.utils import timezone
-from datetime import timedelta
-
-
 class GameCreationTests(APITestCase):
     
     def setUp(self):
@@ -376,3 +398,766 @@ class GameCreationTests(APITestCase):
         }
         response = self.client.post(self.create_game_url, invalid_game_data)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_catches_up_and_skips_frames():
+    scheduler = FixedTimestepScheduler(tick_rate=20, max_catchup=3)
+    scheduler.start()
+    assert await scheduler.wait() == 1
+    assert scheduler.stats.overruns == 0
+
+    # Simulate a frame whose work took about 6 ticks
+    time.sleep(0.3)
+    assert await scheduler.wait() == 3
+    assert scheduler.stats.overruns == 1
+    assert scheduler.stats.skipped >= 2
+    assert scheduler.stats.ticks == 4
+
+
+@pytest.mark.asyncio
+async def test_scheduler_counts_an_early_wakeup_as_one_step_on_time(monkeypatch):
+    async def early_sleep(delay):
+        pass
+
+    monkeypatch.setattr(scheduler_module.asyncio, "sleep", early_sleep)
+    scheduler = FixedTimestepScheduler(tick_rate=20)
+    scheduler.start()
+    assert await scheduler.wait() == 1
+    assert scheduler.last_frame[0] == 0.0
+    assert scheduler.stats.ticks == 1
+    assert scheduler.stats.jitter_total == 0.0
+
+
+def random_game_state(rng):
+    return GameState(
+        BallState(
+            rng.uniform(5, 155),
+            rng.uniform(1, 89),
+            rng.choice([-1, 1]) * rng.uniform(0.8, 2.5),
+            rng.choice([-1, 1]) * rng.uniform(0.5, 2.5),
+        ),
+        PaddleState(10, rng.uniform(0, 75)),
+        PaddleState(150, rng.uniform(0, 75)),
+    )
+
+
+def assert_same_bodies(physics, row, state):
+    from server_side_pong.consumers.physics_numpy import BX, BY, VX, VY, P1Y, P2Y
+    body = physics.bodies[row]
+    ball = state.ball
+    assert (body[BX], body[BY], body[VX], body[VY]) == (ball.x, ball.y, ball.vx, ball.vy)
+    assert body[P1Y] == state.player1.y
+    assert body[P2Y] == state.player2.y
+
+
+class ChannelLayer:
+    """Records the group_send calls of the engine instead of delivering them."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((group, message))
+
+
+def new_game(game_id):
+    """A TwoPlayerPong with the paddles centered and the ball moving right from the middle."""
+    return TwoPlayerPong(game_id, GameState(BallState(80, 45, 1, 0), PaddleState(10, 36.5), PaddleState(150, 36.5)))
+
+
+def test_numpy_physics_matches_python_physics():
+    np = pytest.importorskip("numpy")
+    from server_side_pong.consumers.physics_numpy import NumpyPhysics, SCORERS
+
+    rng = random.Random(42)
+    states = [random_game_state(rng) for _ in range(100)]
+    physics = NumpyPhysics(capacity=16)  # small on purpose, the arrays have to grow
+    rows = [physics.attach(game_id, copy.deepcopy(state)) for game_id, state in enumerate(states)]
+    points = paddle_hits = 0
+
+    for _ in range(2000):
+        paddle_mask = np.zeros(len(physics.bodies), dtype=bool)
+        ball_mask = np.zeros(len(physics.bodies), dtype=bool)
+        for state, row in zip(states, rows):
+            if rng.random() < 0.05:
+                for paddle in (state.player1, state.player2):
+                    paddle.slide = rng.choice([-1, 0, 1])
+            physics.set_inputs(row, state)
+            paddle_mask[row] = True
+            ball_mask[row] = rng.random() < 0.9  # some games are waiting for their serve
+
+        result = physics.step(paddle_mask, ball_mask)
+
+        for state, row in zip(states, rows):
+            speed = abs(state.ball.vx)
+            move_paddles(state)
+            scorer = step_ball(state) if ball_mask[row] else None
+            assert SCORERS.get(int(result[row])) == scorer
+            assert_same_bodies(physics, row, state)
+            if abs(state.ball.vx) > speed:
+                paddle_hits += 1
+            if scorer:
+                points += 1
+                state.ball = random_game_state(rng).ball
+                physics.load(row, state)
+
+    # make sure both the scoring and the paddle collision paths were exercised
+    assert points > 50
+    assert paddle_hits > 50
+
+
+@pytest.mark.parametrize("ball", [
+    (12, 30, -1.5, 0),      # centre of player1's paddle
+    (12, 20.75, -1.5, 1),   # top section boundary
+    (12, 31.25, -1.5, -1),  # bottom section boundary
+    (12, 20, -1.5, 0.5),    # paddle top edge
+    (148, 35, 1.5, -0.5),   # player2's paddle
+    (80, 0.5, 1, -0.5),     # lands exactly on the top wall
+    (1, 45, -1, 0),         # goal for player2
+    (159, 45, 1, 0),        # goal for player1
+])
+def test_numpy_physics_matches_python_physics_edge_cases(ball):
+    np = pytest.importorskip("numpy")
+    from server_side_pong.consumers.physics_numpy import NumpyPhysics, SCORERS
+
+    state = GameState(BallState(*ball), PaddleState(10, 20), PaddleState(150, 30, slide=1))
+    physics = NumpyPhysics(capacity=4)
+    row = physics.attach(1, copy.deepcopy(state))
+    physics.set_inputs(row, state)
+    mask = np.zeros(4, dtype=bool)
+    mask[row] = True
+
+    result = physics.step(mask, mask)
+    move_paddles(state)
+    assert SCORERS.get(int(result[row])) == step_ball(state)
+    assert_same_bodies(physics, row, state)
+
+
+def test_game_state_binary_round_trip():
+    state = GameState(BallState(80.5, 45, -1.05, 0.945), PaddleState(10, 36.5, -1, 7), PaddleState(150, 12, 0), 2, 4)
+    data = state.to_bytes()
+    restored = GameState.from_bytes(data)
+    assert restored.to_dict() == state.to_dict()
+    assert restored.player2.user_id is None
+    assert restored.to_bytes() == data
+
+    with pytest.raises(ValueError):
+        GameState.from_bytes(data[:-1])
+    with pytest.raises(AttributeError):
+        state.ball.vz = 1
+
+
+def test_frame_encoder_sends_deltas_and_keyframes():
+    state = GameState(BallState(80, 45, 1.05, 0.945), PaddleState(10, 36.5), PaddleState(150, 36.5))
+    encoder = FrameEncoder(keyframe_interval=4)
+    decoder = FrameDecoder()
+
+    # a delta before any keyframe is dropped by the decoder
+    other = FrameEncoder()
+    other.encode(state)
+    assert FrameDecoder().apply(other.encode(state)) is None
+    kinds = []
+    for i in range(9):
+        state.ball.x += 1
+        if i == 2:
+            state.player1.y += 3
+        if i == 5:
+            state.add_point("player2")
+        data = encoder.encode(state)
+        kind, seq, fields = decode_frame(data)
+        kinds.append(kind)
+        assert seq == i
+        if kind == DELTA and i not in (2, 5):
+            # only the ball moved
+            assert list(fields) == [BALL_POSITION]
+            assert len(data) == 12
+        decoded = decoder.apply(data)
+        assert decoded["ball"]["x"] == state.ball.x
+        assert decoded["players"]["player1"]["y"] == state.player1.y
+        assert decoded["scores"] == state.scores
+
+    assert kinds == [KEYFRAME, DELTA, DELTA, DELTA, KEYFRAME, DELTA, DELTA, DELTA, KEYFRAME]
+    assert len(encoder.encode(state)) < len(json.dumps({"type": "gameplay", "state": state.to_dict()}))
+
+
+@pytest.mark.asyncio
+async def test_broadcast_forwards_the_frame_encoded_by_the_loop(monkeypatch):
+    class Recipient(GameplayProtocolMixin):
+        def __init__(self, binary):
+            self.binary = binary
+            self.sent = []
+
+        async def send(self, text_data=None, bytes_data=None):
+            self.sent.append(text_data if bytes_data is None else bytes_data)
+
+    state = GameState(BallState(80, 45, 1.05, 0.945), PaddleState(10, 36.5), PaddleState(150, 36.5))
+    group, event = TwoPlayerPong(1, state).frame()
+    assert group == "game_1"
+    assert "state" not in event
+
+    # nobody encodes again on the way out
+    monkeypatch.setattr(json, "dumps", None)
+    recipients = [Recipient(binary=False), Recipient(binary=True), Recipient(binary=False)]
+    for recipient in recipients:
+        await recipient.broadcast_game_state(event)
+
+    assert recipients[0].sent == recipients[2].sent == [event["text"]]
+    assert recipients[0].sent[0] is event["text"]
+    assert recipients[1].sent == [event["frame"]]
+
+
+@pytest.mark.asyncio
+async def test_pong_worker_dispatches_forwarded_messages():
+    class Owner:
+        def __init__(self):
+            self.inputs = asyncio.Queue()
+
+        async def game_input(self, message):
+            await self.inputs.put(message)
+
+    layer = InMemoryChannelLayer()
+    owner = Owner()
+    owning_worker = PongWorker(owner, layer)
+    other_worker = PongWorker(Owner(), layer)
+    channel_name = await owning_worker.get_channel_name()
+    assert channel_name != await other_worker.get_channel_name()
+
+    await other_worker.send(channel_name, {"type": "game.unknown"})
+    await other_worker.send(channel_name, {"type": "game.input", "game_id": 3, "role": "player2", "data": {"type": "gameplay"}})
+    message = await asyncio.wait_for(owner.inputs.get(), timeout=1)
+    assert message["game_id"] == 3 and message["role"] == "player2"
+
+    owning_worker.task.cancel()
+    other_worker.task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_inputs_are_queued_until_the_tick_drains_them():
+    state = GameState(BallState(80, 45, 1.05, 0.945), PaddleState(10, 36.5), PaddleState(150, 36.5))
+    game = TwoPlayerPong(1, state)
+    await game.remote_update_state("player1", {"type": "gameplay", "action": "keydown", "movement": "w", "seq": 1})
+    await game.remote_update_state("player2", {"type": "gameplay", "action": "keydown", "movement": "ArrowDown", "seq": 7})
+    await game.remote_update_state("player1", {"type": "gameplay", "action": "keyup", "movement": "w", "seq": 2})
+    await game.remote_update_state("player1", {"type": "gameplay", "action": "keydown", "movement": "s", "seq": 3})
+    await game.remote_update_state(None, {"type": "gameplay", "action": "keydown", "movement": "w", "seq": 4})
+    assert (state.player1.slide, state.player2.slide) == (0, 0)
+
+    game.drain_inputs()
+    assert (state.player1.slide, state.player2.slide) == (1, 1)
+    assert game.acks == {"player1": 3, "player2": 7}
+    assert not game.inputs
+
+    _, event = game.frame()
+    frame = json.loads(event["text"])
+    assert frame["ack"] == {"player1": 3, "player2": 7}
+    # stamped for the clients to measure the delivery latency (see load_websockets)
+    assert 0 <= time.time() - frame["sent"] < 1
+
+
+def test_game_state_redis_hash_round_trip():
+    state = GameState(BallState(80.5, 45, -1.05, 0.945), PaddleState(10, 36.5, -1, 7), PaddleState(150, 12, 0), 2, 4)
+    fields = state.to_hash()
+    assert "player2" not in fields
+    # HGETALL gives bytes back
+    stored = {key.encode(): value if isinstance(value, bytes) else str(value).encode() for key, value in fields.items()}
+    restored = GameState.from_hash(stored)
+    assert restored.to_dict() == state.to_dict()
+
+    with pytest.raises(ValueError):
+        GameState.from_hash({b"score1": b"0"})
+
+
+@pytest.mark.asyncio
+async def test_engine_batches_redis_access_around_the_tick():
+    class Store:
+        def __init__(self):
+            self.calls = []
+
+        async def arefresh_games(self, games):
+            self.calls.append(("refresh", [game.game_id for game in games], [bool(game.inputs) for game in games]))
+
+        async def aflush_games(self, games):
+            self.calls.append(("flush", [game.game_id for game in games], [game.pending_points[:] for game in games]))
+
+    store = Store()
+    engine = PongEngine(store=store)
+    engine.channel_layer = ChannelLayer()
+    games = [
+        TwoPlayerPong(1, GameState(BallState(1, 45, -1, 0), PaddleState(10, 60), PaddleState(150, 36.5))),
+        new_game(2),
+    ]
+    for game in games:
+        game.start()
+        game.serve_at = 0
+        engine.games[game.game_id] = game
+    await games[1].remote_update_state("player1", {"type": "gameplay", "action": "keydown", "movement": "w", "seq": 1})
+
+    await engine.tick(1, FixedTimestepScheduler())
+
+    # one reload before the inputs are applied, one flush with the point scored by game 1
+    assert store.calls == [("refresh", [1, 2], [False, True]), ("flush", [1, 2], [["player2"], []])]
+    assert games[0].paused and games[0].game_state.score2 == 1
+    assert games[1].game_state.player1.slide == -1
+
+
+@pytest.mark.asyncio
+async def test_engine_drops_the_games_that_stopped_running():
+    engine = PongEngine()
+    engine.channel_layer = ChannelLayer()
+    game = new_game(1)
+    engine.add(game)
+    task = engine.task
+    task.cancel()
+    assert game.running and engine.games == {1: game}
+    assert metrics.ACTIVE_GAMES.value == 1
+    engine.add(game)  # already registered
+    assert engine.task is task
+
+    await game.stop_game_loop()
+    await engine.tick(1, FixedTimestepScheduler())
+    assert engine.games == {}
+    assert metrics.ACTIVE_GAMES.value == 0
+
+
+@pytest.mark.asyncio
+async def test_engine_skips_paused_games_and_settles_a_scored_point_off_the_tick(monkeypatch):
+    engine = PongEngine()
+    engine.channel_layer = ChannelLayer()
+    ended = []
+    settled = asyncio.Event()
+
+    async def end_round(game):
+        await settled.wait()
+        ended.append(game.game_id)
+
+    monkeypatch.setattr(engine, "end_round", end_round)
+    scoring = TwoPlayerPong(1, GameState(BallState(1, 45, -1, 0), PaddleState(10, 60), PaddleState(150, 36.5)))
+    paused = new_game(2)
+    for game in (scoring, paused):
+        game.start()
+        game.serve_at = 0
+        engine.games[game.game_id] = game
+    paused.paused = True
+
+    await engine.tick(1, FixedTimestepScheduler())
+
+    assert paused.steps == 0 and paused.game_state.ball.x == 80
+    assert scoring.paused and scoring.game_state.score2 == 1
+    # the tick did not wait for the round to be settled
+    assert len(engine.round_tasks) == 1 and ended == []
+    settled.set()
+    await asyncio.gather(*engine.round_tasks)
+    assert ended == [1]
+    assert not engine.round_tasks
+
+
+@pytest.mark.asyncio
+async def test_spawn_keeps_the_task_until_it_is_done_and_logs_its_failure(caplog):
+    async def fail():
+        raise RuntimeError("boom")
+
+    running = set()
+    task = spawn(running, fail(), "End of round of game 7")
+    assert running == {task}
+    with caplog.at_level("ERROR"):
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0)
+    assert running == set()
+    assert "End of round of game 7 failed" in caplog.text
+
+
+def test_checkpoint_waits_for_the_interval_in_memory_mode(settings):
+    settings.PONG_IN_MEMORY_STATE = True
+    settings.PONG_CHECKPOINT_INTERVAL = 1.0
+    game = new_game(1)
+
+    game.checkpoint()
+    assert not game.dirty
+    game.checkpoint(force=True)
+    assert game.dirty
+
+    game.dirty = False
+    game.last_checkpoint -= 1.0
+    game.checkpoint()
+    assert game.dirty
+    game.dirty = False
+    game.checkpoint()
+    assert not game.dirty
+
+
+@pytest.mark.asyncio
+async def test_redis_stays_authoritative_without_in_memory_state(settings, monkeypatch):
+    stored = GameState(BallState(20, 30, -1, 0), PaddleState(10, 50), PaddleState(150, 20))
+    stored_hash = {key.encode(): value if isinstance(value, bytes) else str(value).encode() for key, value in stored.to_hash().items()}
+
+    class Pipeline:
+        def __init__(self):
+            self.keys = []
+
+        def hgetall(self, key):
+            self.keys.append(key)
+
+        async def execute(self):
+            return [stored_hash for _ in self.keys]
+
+    class Redis:
+        def pipeline(self, transaction=True):
+            return Pipeline()
+
+    monkeypatch.setattr(consumers, "get_async_redis", Redis)
+    settings.PONG_IN_MEMORY_STATE = False
+    settings.PONG_CHECKPOINT_INTERVAL = 1.0
+    games = [new_game(game_id) for game_id in (1, 2)]
+
+    # every checkpoint is written, whatever the interval
+    games[1].checkpoint()
+    assert games[1].dirty
+
+    # the state is reloaded from Redis before the tick, unless it has writes Redis has not seen yet
+    await GameManager.arefresh_games(games)
+    assert games[0].game_state.to_dict() == stored.to_dict()
+    assert games[1].game_state.ball.x == 80
+
+
+@pytest.mark.django_db
+def test_reaper_only_reaps_finished_or_deleted_games():
+    games = {
+        status: Game.objects.create(name=f"reaper_{status}", rounds_needed=3, game_type="remote", status=status)
+        for status in ("waiting", "ongoing", "completed", "interrupted")
+    }
+    deleted_id = max(game.id for game in games.values()) + 1
+
+    ids = [game.id for game in games.values()] + [deleted_id]
+    assert game_ids_to_reap(ids) == {games["completed"].id, games["interrupted"].id, deleted_id}
+
+
+@pytest.mark.django_db
+def test_reaper_keeps_the_legacy_keys_of_live_games(monkeypatch):
+    class Redis:
+        def __init__(self, keys):
+            self.keys = {key.encode(): 1 for key in keys}
+
+        def scan_iter(self, match, count):
+            return [key for key in list(self.keys) if fnmatch.fnmatchcase(key.decode(), match)]
+
+        def pipeline(self, transaction=True):
+            class Pipeline(list):
+                def memory_usage(self, key):
+                    self.append(key)
+
+                def execute(self):
+                    return [8 for _ in self]
+            return Pipeline()
+
+        def delete(self, *keys):
+            for key in keys:
+                del self.keys[key]
+            return len(keys)
+
+    live = Game.objects.create(name="reaper_live", rounds_needed=3, game_type="remote", status="ongoing")
+    done = Game.objects.create(name="reaper_done", rounds_needed=3, game_type="remote", status="completed")
+    redis = Redis([str(live.id), str(done.id), f"pong:game:{done.id}", "celery"])
+    monkeypatch.setattr(tasks, "get_redis", lambda: redis)
+
+    assert tasks.reap_pong_keys() == {"keys": 2, "bytes": 16}
+    assert set(redis.keys) == {str(live.id).encode(), b"celery"}
+
+
+@pytest.mark.asyncio
+async def test_persistence_queue_batches_results():
+    batches = []
+    queue = PersistenceQueue(max_batch=2, writer=batches.append)
+    now = timezone.now()
+    saved = [queue.submit(MatchResult(game_id, 10 + game_id, now)) for game_id in (1, 2, 3)]
+    assert not any(done.done() for done in saved)
+    await queue.join()
+
+    # submit() never waits, the results are written two by two in the background
+    assert [[result.game_id for result in batch] for batch in batches] == [[1, 2], [3]]
+    assert [done.result() for done in saved] == [True, True, True]
+
+
+@pytest.mark.asyncio
+async def test_game_result_is_saved_before_it_is_announced(monkeypatch):
+    events = []
+    monkeypatch.setattr(GameManager, "persistence", PersistenceQueue(writer=lambda results: events.append("saved")))
+
+    async def noop(*args, **kwargs):
+        pass
+
+    async def broadcast(game_id, state):
+        events.append(state["type"])
+
+    monkeypatch.setattr(GameManager, "afinish_game", noop)
+    monkeypatch.setattr(GameManager, "abroadcast_state", broadcast)
+    game = TwoPlayerPong(1, GameManager.new_game_state())
+    game.match = MatchDescriptor(1, 3, None, "remote", 11, 12, "a", "b")
+    monkeypatch.setattr(game, "flush", noop)
+    monkeypatch.setattr(game, "save_replay", noop)
+
+    await game.end_of_game("player1")
+    assert events == ["saved", "ending"]
+
+
+@pytest.mark.django_db
+def test_write_results_completes_the_games_and_updates_the_statistics():
+    user1 = CustomUser.objects.create_user(username="Winner", email="winner@example.com", password="TestPassword1")
+    user2 = CustomUser.objects.create_user(username="Loser", email="loser@example.com", password="TestPassword1")
+    game = Game.objects.create(
+        name="persisted", rounds_needed=3, game_type="remote", status="ongoing",
+        player1_id=user1.id, player2_id=user2.id,
+    )
+
+    write_results([MatchResult(game.id, user1.id, timezone.now()), MatchResult(game.id + 1, user2.id, timezone.now())])
+
+    game.refresh_from_db()
+    assert game.status == "completed" and game.winner_id == user1.id and game.end_time is not None
+    # post_save is still sent for the statistics
+    assert PlayerStatistics.objects.get(player_id=user1.id).matches_won == 1
+    assert PlayerStatistics.objects.get(player_id=user2.id).matches_won == 0
+
+
+@pytest.mark.django_db
+def test_match_descriptor_is_loaded_in_one_query(django_assert_num_queries):
+    user1 = CustomUser.objects.create_user(username="Left", email="left@example.com", password="TestPassword1")
+    user2 = CustomUser.objects.create_user(username="Right", email="right@example.com", password="TestPassword1")
+    Player.objects.filter(id=user1.id).update(nickname="lefty")
+    Player.objects.filter(id=user2.id).update(nickname="righty")
+    game = Game.objects.create(
+        name="described", rounds_needed=5, game_type="remote", status="ongoing",
+        player1_id=user1.id, player2_id=user2.id,
+    )
+
+    with django_assert_num_queries(1):
+        match = MatchDescriptor.from_game(Game.objects.select_related("player1", "player2").get(id=game.id))
+
+    assert match.rounds_needed == 5 and match.game_type == "remote" and not match.is_tournament
+    assert match.role_of(user2.id) == "player2" and match.opponent("player2") == "player1"
+    assert match.nickname("player1") == "lefty" and match.player_id("player2") == user2.id
+
+
+@pytest.mark.asyncio
+async def test_join_script_is_registered_once_per_event_loop():
+    script = get_async_script(JOIN_GAME_SCRIPT)
+    assert get_async_script(JOIN_GAME_SCRIPT) is script
+
+
+@pytest.mark.asyncio
+async def test_anonymous_spectators_are_rejected():
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), "/ws/server_side_pong/spectate/1/")
+    communicator.scope["user"] = AnonymousUser()
+    connected, code = await communicator.connect()
+    assert not connected and code == 4003
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_a_waiting_game_left_by_a_user_not_seated_is_interrupted(monkeypatch, caplog):
+    game = await Game.objects.acreate(name="not seated", rounds_needed=3, game_type="remote", status="waiting")
+    stopped = []
+
+    async def no_winner(game_id):
+        return None
+
+    async def stop_game(game_id):
+        stopped.append(game_id)
+
+    monkeypatch.setattr(GameManager, "agame_winner", no_winner)
+    monkeypatch.setattr(GameManager, "stop_game", stop_game)
+    consumer = consumers.RemotePongConsumer()
+    consumer.game_id, consumer.user_id = game.id, 4242
+    consumer.group_name, consumer.channel_name = f"game_{game.id}", "test"
+    consumer.channel_layer = InMemoryChannelLayer()
+
+    with caplog.at_level("INFO"):
+        await consumer.disconnect(1000)
+
+    await game.arefresh_from_db()
+    assert game.status == "interrupted" and stopped == [game.id]
+    assert "disconnection of player 4242 with id4242" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_spectators_get_their_own_group_at_a_lower_rate():
+    engine = PongEngine(tick_rate=60, spectator_rate=20)
+    engine.channel_layer = ChannelLayer()
+    game = new_game(1)
+    game.start()
+    engine.games[game.game_id] = game
+
+    for _ in range(6):
+        await engine.tick(1, FixedTimestepScheduler())
+
+    groups = [group for group, _ in engine.channel_layer.sent]
+    assert groups.count("game_1") == 6
+    assert groups.count("spectate_1") == 2
+    # the spectator deltas start from a keyframe of their own
+    first = next(message for group, message in engine.channel_layer.sent if group == "spectate_1")
+    assert decode_frame(first["frame"])[0] == KEYFRAME
+
+
+def test_simulation_is_deterministic_for_a_seed():
+    def play(seed):
+        simulation = PongSimulation(1, GameManager.new_game_state(), seed=seed)
+        serves = []
+        for tick in range(5000):
+            simulation.game_state.player1.slide = -1 if tick % 40 < 20 else 1
+            if simulation.advance(1, 1 / 60):
+                simulation.next_round()
+                serves.append((simulation.game_state.ball.vx, simulation.game_state.ball.vy))
+        return simulation.game_state.scores, serves, simulation.game_state.to_dict()
+
+    assert play(42) == play(42)
+    assert play(42)[1] != play(7)[1]
+
+
+def test_bench_pong_command_reports_the_tick_loop():
+    out = StringIO()
+    call_command("bench_pong", matches=3, rounds=1, alloc_ticks=10, stdout=out)
+    report = out.getvalue()
+
+    assert "finished: 3" in report
+    assert "p99" in report and "allocated per tick" in report
+
+
+def test_replay_recorder_round_trip():
+    recorder = ReplayRecorder(keyframe_interval=2)
+    game_state = GameManager.new_game_state()
+    chunks = []
+    for tick in range(5):
+        if tick == 1:
+            recorder.input("player2", -1)
+        game_state.ball.x += 1
+        recorder.tick(game_state)
+        if tick == 2:
+            chunks.append(recorder.take_chunk())
+    chunks.append(recorder.take_chunk())
+    assert recorder.take_chunk() is None
+
+    events = list(replay_events(read_archive(archive(chunks))))
+    assert [(event["type"], event["tick"]) for event in events] == [
+        ("keyframe", 0), ("input", 1), ("keyframe", 2), ("keyframe", 4),
+    ]
+    assert events[1]["role"] == "player2" and events[1]["slide"] == -1
+    assert events[-1]["state"]["ball"]["x"] == game_state.ball.x
+    # seeking starts from a whole state
+    assert [event["tick"] for event in replay_events(chunks, start=1)] == [2, 4]
+
+
+def test_replay_ticks_follow_the_simulation_steps_when_the_engine_catches_up():
+    game = TwoPlayerPong(1, GameManager.new_game_state(), seed=1)
+    game.replay.keyframe_interval = 4
+    physics = PythonPhysics()
+    for steps in (1, 3, 2):  # a tick that catches up advances several steps
+        physics.advance([game], steps, 1 / 60)
+        game.record_tick()
+
+    assert game.replay.ticks == game.steps == 6
+    assert [record[1] for record in read_chunk(game.replay.take_chunk())] == [0, 5]
+
+
+@pytest.mark.django_db
+def test_replay_endpoint_streams_the_archived_replay(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    user = CustomUser.objects.create_user(username="Viewer", email="viewer@example.com", password="TestPassword1")
+    game = Game.objects.create(name="replayed", rounds_needed=3, game_type="remote", status="completed")
+    recorder = ReplayRecorder()
+    recorder.tick(GameManager.new_game_state())
+    default_storage.save(replay_path(game.id), ContentFile(archive([recorder.take_chunk()])))
+
+    client = APIClient()
+    client.force_authenticate(user=user)
+    response = client.get(f"/api/games/{game.id}/replay/")
+
+    assert response.status_code == 200
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    assert len(lines) == 1 and '"keyframe"' in lines[0]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_load_websockets_command_measures_the_chat():
+    out = StringIO()
+    # driven by the message count, the duration is only a safety net
+    call_command(
+        "load_websockets", games=0, chatters=3, messages=2, duration=60, chat_interval=0,
+        channel_layer="memory", allow_prod=True, stdout=out,
+    )
+    report = out.getvalue()
+
+    assert "failures: 0" in report
+    assert "chat message round trip: p50" in report and "(6 samples)" in report
+    assert "frame delivery (server send to receive): no samples" in report
+    assert "CPU:" in report
+    assert not User.objects.filter(username__startswith="loadtest_").exists()
+
+
+@pytest.mark.asyncio
+async def test_engine_tick_feeds_the_metrics():
+    engine = PongEngine()
+    engine.channel_layer = ChannelLayer()
+    game = new_game(1)
+    engine.games[game.game_id] = game
+    game.start()
+    await game.remote_update_state("player1", {"type": "gameplay", "action": "keydown", "movement": "w", "seq": 1})
+    ticks, broadcasts, inputs = metrics.TICKS.value, metrics.BROADCAST_DURATION.count, metrics.INPUT_TO_BROADCAST.count
+
+    await engine.tick(1, FixedTimestepScheduler())
+
+    assert metrics.TICKS.value == ticks + 1
+    assert metrics.BROADCAST_DURATION.count == broadcasts + 1
+    assert metrics.INPUT_TO_BROADCAST.count == inputs + 1
+
+
+def test_metrics_endpoint_renders_the_prometheus_format(settings):
+    settings.PONG_METRICS_TOKEN = ""
+    assert Client().get("/api/metrics/").status_code == 403
+
+    settings.PONG_METRICS_TOKEN = "scrape"
+    assert Client().get("/api/metrics/").status_code == 403
+
+    response = Client().get("/api/metrics/", HTTP_AUTHORIZATION="Bearer scrape")
+    assert response.status_code == 200
+    body = response.content.decode()
+    assert "# TYPE pong_tick_duration_seconds histogram" in body
+    assert 'pong_tick_duration_seconds_bucket{le="+Inf"}' in body
+    assert "pong_active_games " in body
+    assert "# TYPE pong_tick_overruns_total counter" in body
+    assert "pong_tick_jitter_max_seconds " in body
+
+
+def test_metrics_read_the_scheduler_stats_of_the_engine():
+    stats = PongEngine().stats
+    assert stats is metrics.TICK_STATS
+    skipped, overruns = stats.skipped, stats.overruns
+    stats.record(0.05, 5, 2, True)
+
+    body = metrics.render([metrics.FRAMES_DROPPED, metrics.OVERRUNS, metrics.JITTER_MAX])
+    assert f"pong_frames_dropped_total {skipped + 2}" in body
+    assert f"pong_tick_overruns_total {overruns + 1}" in body
+    assert f"pong_tick_jitter_max_seconds {stats.jitter_max}" in body
+
+
+@pytest.mark.asyncio
+async def test_engine_sends_fewer_frames_under_load_except_to_tournaments():
+    engine = PongEngine(tick_rate=60, spectator_rate=60, tick_budget=0.8)
+    # one second of ticks far over budget: one level down
+    for _ in range(60):
+        engine.ticks += 1
+        engine.adapt(1.0)
+    assert engine.level == 1
+
+    engine.channel_layer = ChannelLayer()
+    friendly = new_game(1)
+    final = new_game(2)
+    final.match = MatchDescriptor(2, 3, 7, "remote", 1, 2, "a", "b")
+    for game in (friendly, final):
+        game.start()
+        engine.games[game.game_id] = game
+    for _ in range(4):
+        await engine.tick(1, FixedTimestepScheduler())
+
+    groups = [group for group, _ in engine.channel_layer.sent]
+    assert groups.count("game_1") == 2 and groups.count("game_2") == 4
+    frame = next(message for group, message in engine.channel_layer.sent if group == "game_1")
+    assert FrameDecoder().apply(frame["frame"])["interval"] == 33
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import GameViewSet
+from .views import GameViewSet, metrics_view
 
 # Initialize the router
 router = DefaultRouter()
@@ -8,4 +8,5 @@ router.register(r'games', GameViewSet, basename='game')
 
 urlpatterns = [
     path('', include(router.urls)),  # Include all routes registered in the router
+    path('metrics/', metrics_view, name='pong-metrics'),  # Prometheus scrape target
 ]
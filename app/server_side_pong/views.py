@@ -1,11 +1,18 @@
 from rest_framework.response import Response
 from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from django.http import HttpResponse, StreamingHttpResponse
+from django.conf import settings
+from django.core.files.storage import default_storage
+from hello_django.redis_clients import get_redis
 from .models import Game
 from .serializers import GameSerializer
 from users.models import CustomUser
 from server_side_pong.consumers import consumers
+from server_side_pong.consumers.replay import read_archive, replay_events, replay_key, replay_path
+from server_side_pong.consumers import metrics
 from matchmaking.models import Tournament
-import socket
+import socket, json
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Q
 from rest_framework.exceptions import ValidationError, PermissionDenied
@@ -28,6 +35,18 @@ def get_local_ip():
         #print(f"Error obtaining IP: {e}")
         return "localhost"  # Fallback to localhost if there's an error
 
+def metrics_view(request):
+    """
+    Metrics of the pong engine of the process serving the request, in the Prometheus text
+    format. The engine runs in the ASGI process, so nginx sends this path to daphne, not
+    gunicorn. The scraper must send PONG_METRICS_TOKEN as a bearer token; without a token
+    configured the endpoint is closed.
+    """
+    token = settings.PONG_METRICS_TOKEN
+    if not token or request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 class GameViewSet(viewsets.ModelViewSet):
     serializer_class = GameSerializer
     permission_classes = [IsAuthenticated]
@@ -70,6 +89,29 @@ class GameViewSet(viewsets.ModelViewSet):
                 raise PermissionDenied({"name":"You are not allowed to create a game outside of a tournament while you are in an active tournament."})
 
 
+    def _replay_chunks(self, game_id):
+        """Compressed replay chunks of a game: from its archive once archived, from Redis before."""
+        path = replay_path(game_id)
+        if default_storage.exists(path):
+            with default_storage.open(path, "rb") as replay_file:
+                return list(read_archive(replay_file.read()))
+        return get_redis().lrange(replay_key(game_id), 0, -1)
+
+    @action(detail=True, methods=['get'])
+    def replay(self, request, pk=None):
+        """Streams the replay of a game as newline delimited JSON, from the first keyframe at or after ?from=<tick>."""
+        game = self.get_object()
+        try:
+            start = int(request.query_params.get('from', 0))
+        except ValueError:
+            raise ValidationError({"from": "Must be a tick number."})
+
+        chunks = self._replay_chunks(game.id)
+        if not chunks:
+            return Response({"detail": "No replay recorded for this game."}, status=status.HTTP_404_NOT_FOUND)
+        lines = (json.dumps(event) + "\n" for event in replay_events(chunks, start))
+        return StreamingHttpResponse(lines, content_type="application/x-ndjson")
+
     def create(self, request, *args, **kwargs):
         user = request.user
         player = user.player_profile